@@ -0,0 +1,46 @@
+import zipfile
+
+import whatsapp_analyzer_batch as batch
+
+CHAT = ''.join(f'15/01/2024, 10:{minute:02d} - Alice: message {minute}\n' for minute in range(10))
+
+
+def test_analyze_export_reads_zip_exports(tmp_path):
+    path = tmp_path / 'chat.zip'
+    with zipfile.ZipFile(path, 'w') as zip_file:
+        zip_file.writestr('_chat.txt', CHAT)
+
+    row = batch.analyze_export(str(path), str(tmp_path / 'out'))
+
+    assert row['error'] is None
+    assert row['messages'] == 10
+    assert (tmp_path / 'out' / 'chat_zip' / 'report.json').exists()
+
+
+def test_analyze_export_reports_a_txt_without_messages(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('shopping list\nmilk\n', encoding='utf-8')
+
+    row = batch.analyze_export(str(path), str(tmp_path / 'out'))
+
+    assert 'ValueError: no messages found' in row['error']
+    assert row['messages'] == 0
+    assert not (tmp_path / 'out').exists()
+
+
+def test_exports_with_clashing_names_get_their_own_output_dirs(tmp_path):
+    export_dir = tmp_path / 'exports'
+    export_dir.mkdir()
+    for name in ('chat.txt.zip', 'chat_txt.zip'):
+        with zipfile.ZipFile(export_dir / name, 'w') as zip_file:
+            zip_file.writestr('_chat.txt', CHAT)
+
+    summary = batch.run_batch(str(export_dir), str(tmp_path / 'out'), workers=2, progress=lambda line: None)
+
+    assert summary['error'].isna().all()
+    assert sorted(summary['output']) == ['chat_txt_zip', 'chat_txt_zip-2']
+    assert (tmp_path / 'out' / 'chat_txt_zip-2' / 'report.json').exists()
+
+
+def test_output_dir_names_are_unique_ignoring_case():
+    assert batch.output_dir_names(['a/Chat.txt', 'b/chat.txt', 'c/chat_txt-2.zip']) == ['Chat_txt', 'chat_txt-2', 'chat_txt-2_zip']
@@ -0,0 +1,195 @@
+import io
+import os
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+import pytest
+
+import whatsapp_analyzer_core as core
+
+
+def test_detect_timestamp_format_day_first_from_a_day_above_12():
+    fmt = core.detect_timestamp_format(['05/01/2024', '13/01/2024'], ['20:30', '08:15'], 'standard')
+
+    assert fmt['date_order'] == 'DMY'
+    assert fmt['clock'] == '24h'
+    assert fmt['seconds'] is False
+    assert fmt['format'] == '%d/%m/%Y %H:%M'
+
+
+def test_detect_timestamp_format_month_first_from_a_day_above_12():
+    fmt = core.detect_timestamp_format(['1/5/24', '1/13/24'], ['8:30 PM', '9:05 AM'], 'standard')
+
+    assert fmt['date_order'] == 'MDY'
+    assert fmt['clock'] == '12h'
+    assert fmt['format'] == '%m/%d/%y %I:%M %p'
+
+
+def test_detect_timestamp_format_ambiguous_dates_follow_the_smaller_steps():
+    # Read day-first these are consecutive days; month-first they jump a month at a time
+    dates = ['01/02/2024', '02/02/2024', '03/02/2024']
+
+    assert core.detect_timestamp_format(dates, ['10:00'] * 3, 'standard')['date_order'] == 'DMY'
+
+
+def test_detect_timestamp_format_iso_with_seconds():
+    fmt = core.detect_timestamp_format(['2024-01-05', '2024-01-06'], ['20:30:15', '08:15:00'], 'iso')
+
+    assert fmt['date_order'] == 'YMD'
+    assert fmt['seconds'] is True
+    assert fmt['format'] == '%Y-%m-%d %H:%M:%S'
+
+
+def test_parse_timestamps_applies_the_detected_format():
+    fmt = core.detect_timestamp_format(['05/01/2024', '13/01/2024'], ['20:30', '08:15'], 'standard')
+
+    timestamps = core.parse_timestamps(['05/01/2024', '13/01/2024'], ['20:30', '08:15'], fmt)
+
+    assert list(timestamps) == [pd.Timestamp('2024-01-05 20:30'), pd.Timestamp('2024-01-13 08:15')]
+
+
+# Several days of a chat with multi-line messages and system lines, as export bytes
+CHAT_BYTES = ''.join(
+    f'{day:02d}/01/2024, {hour:02d}:{minute:02d} - {sender}: message {day}-{hour}-{minute}\n'
+    + ('second line\nthird line\n' if minute % 7 == 0 else '')
+    + (f'{day:02d}/01/2024, {hour:02d}:{minute:02d} - {sender} joined\n' if minute == 30 else '')
+    for day in range(1, 8) for hour in range(8, 20) for minute in range(0, 60, 3)
+    for sender in (['Alice', 'Bob'][(day + hour + minute) % 2],)
+).encode('utf-8')
+
+
+def test_sharded_parse_matches_the_serial_parse():
+    serial = core.parse_whatsapp_bytes(CHAT_BYTES, workers=1)
+    sharded = core.parse_whatsapp_bytes(CHAT_BYTES, workers=3, parallel_threshold=0)
+
+    assert len(core.split_shards(CHAT_BYTES, 'standard', 3)) == 3
+    assert len(serial) == 7 * 12 * 20
+    assert serial['message'].str.endswith('third line').any()
+    pd.testing.assert_frame_equal(sharded, serial)
+
+
+def test_sharded_parse_recovers_from_a_dead_pool_worker():
+    pool = core._get_pool(2)
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+
+    df = core.parse_whatsapp_bytes(CHAT_BYTES, workers=2, parallel_threshold=0)
+
+    assert len(df) == 7 * 12 * 20
+    assert core._pools.get(2) is not pool
+    assert len(core.parse_whatsapp_bytes(CHAT_BYTES, workers=2, parallel_threshold=0)) == 7 * 12 * 20
+
+
+def test_sliced_cube_counts_match_a_groupby_of_the_messages():
+    df = core.parse_whatsapp_bytes(CHAT_BYTES)
+    start, end = pd.Timestamp('2024-01-02'), pd.Timestamp('2024-01-05')
+    cube = core.slice_cube(core.build_count_cube(df), start, end, senders=['Bob'])
+
+    day = df['datetime'].dt.normalize()
+    selected = df[(day >= start) & (day <= end) & (df['sender'] == 'Bob')]
+    expected_days = selected.groupby(selected['datetime'].dt.normalize()).size()
+
+    assert core.cube_counts(cube, 'day').tolist() == expected_days.tolist()
+    assert core.cube_counts(cube, 'day').index.equals(expected_days.index)
+    assert core.cube_counts(cube, 'hour').to_dict() == selected['hour'].value_counts().reindex(range(24), fill_value=0).to_dict()
+    assert core.cube_counts(cube, 'sender').to_dict() == {'Bob': len(selected)}
+    weekdays = selected['weekday'].astype(str).value_counts()
+    assert core.cube_counts(cube, 'weekday')[lambda counts: counts > 0].rename(str).to_dict() == weekdays.to_dict()
+    assert core.cube_active_days(cube) == selected['datetime'].dt.normalize().nunique()
+
+
+def test_weekly_activity_keeps_iso_weeks_apart_across_new_year():
+    # 29/12/2020 and 02/01/2021 are both in ISO week 53 of 2020; ISO week 1 of 2021 is quiet
+    text = (
+        '29/12/2020, 10:00 - Alice: one\n29/12/2020, 11:00 - Bob: two\n'
+        '02/01/2021, 10:00 - Alice: three\n02/01/2021, 12:00 - Bob: four\n'
+        '12/01/2021, 09:00 - Alice: five\n12/01/2021, 09:30 - Alice: six\n12/01/2021, 10:00 - Bob: seven\n'
+    )
+    weekly = core.weekly_activity(core.build_count_cube(core.parse_whatsapp_bytes(text.encode('utf-8'))))
+
+    assert weekly.index.tolist() == [(2020, 53), (2021, 1), (2021, 2)]
+    assert weekly['messages'].tolist() == [4, 0, 3]
+    assert weekly.loc[(2020, 53), 'first_day'] == pd.Timestamp('2020-12-29')
+    assert weekly.loc[(2020, 53), 'last_day'] == pd.Timestamp('2021-01-02')
+    assert pd.isna(weekly.loc[(2021, 1), 'first_day'])
+    change = weekly['change_percent'].tolist()
+    assert pd.isna(change[0]) and change[1:] == [-100, 0]
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc/self/fd')
+def test_closing_the_zip_chat_stream_closes_the_archive(tmp_path):
+    path = tmp_path / 'chat.zip'
+    with zipfile.ZipFile(path, 'w') as zip_file:
+        zip_file.writestr('_chat.txt', CHAT_BYTES)
+    before = len(os.listdir('/proc/self/fd'))
+
+    stream, _ = core.open_txt_from_zip(str(path))
+    assert len(os.listdir('/proc/self/fd')) == before + 1
+    stream.close()
+
+    assert len(os.listdir('/proc/self/fd')) == before
+
+
+# iOS export: every attachment line starts with a left-to-right mark
+IOS_CHAT = (
+    '[15/01/2024, 10:20:01] Alice: Morning\n'
+    '[15/01/2024, 10:21:12] Alice: Look at this\n'
+    'second line\n'
+    '\u200e[15/01/2024, 10:22:33] Bob: \u200e<attached: 00000001-PHOTO-2024-01-15-10-22-33.jpg>\n'
+    '[15/01/2024, 10:23:45] Alice: Nice\n'
+)
+
+
+def test_lrm_prefixed_attachment_line_is_its_own_message():
+    df = core.parse_whatsapp_content(IOS_CHAT)
+
+    assert list(df['sender'].astype(str)) == ['Alice', 'Alice', 'Bob', 'Alice']
+    assert df['message'].iloc[1] == 'Look at this\nsecond line'
+    assert '<attached: 00000001-PHOTO-2024-01-15-10-22-33.jpg>' in df['message'].iloc[2]
+    assert df['is_media'].tolist() == [False, False, True, False]
+
+
+def test_lrm_prefixed_lines_split_shards_and_bytes_parse_alike():
+    data = IOS_CHAT.encode('utf-8') * 50
+
+    assert core.detect_line_format(IOS_CHAT.split('\n')) == 'bracket'
+    for start, end in core.split_shards(data, 'bracket', 7)[1:]:
+        assert core.LINE_FORMATS['bracket'].match(core.clean_line(data[start:end].decode('utf-8')))
+    serial = core.parse_whatsapp_content(data.decode('utf-8'))
+    assert (serial['sender'].astype(str) == 'Bob').sum() == 50
+
+
+def test_media_by_sender_credits_lrm_prefixed_attachment_to_its_sender():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr('_chat.txt', IOS_CHAT)
+        zip_file.writestr('00000001-PHOTO-2024-01-15-10-22-33.jpg', b'x' * 1234)
+
+    archive.seek(0)
+    stream, _ = core.open_txt_from_zip(archive)
+    with stream:
+        df = core.parse_whatsapp_stream(stream)
+    totals = core.media_by_sender(df, core.read_media_manifest(archive))
+
+    assert totals.index.tolist() == ['Bob']
+    assert totals.loc['Bob', 'files'] == 1
+    assert totals.loc['Bob', 'bytes'] == 1234
+
+
+def test_token_index_round_trips_through_merged_token_counts():
+    df = core.parse_whatsapp_bytes(CHAT_BYTES)
+    index = core.build_token_index(df)
+    half = len(df) // 2
+    merged = core.merge_token_counts(
+        core.token_counts(core.build_token_index(df.iloc[:half])),
+        core.token_counts(core.build_token_index(df.iloc[half:])),
+    )
+
+    rebuilt = core.token_index_from_counts(merged)
+
+    assert sorted(core.top_words(rebuilt, 10**6)) == sorted(core.top_words(index, 10**6))
+    start, end = '2024-01-02', '2024-01-04'
+    assert sorted(core.top_words(core.slice_cube(rebuilt, start, end, ['Bob']), 10**6)) == sorted(
+        core.top_words(core.slice_cube(index, start, end, ['Bob']), 10**6)
+    )
@@ -0,0 +1,56 @@
+import pandas as pd
+
+import whatsapp_analyzer_search as search
+
+
+def _index(rows):
+    conn = search.open_search_index()
+    df = pd.DataFrame(rows, columns=['datetime', 'sender', 'message'])
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    search.index_messages(conn, df)
+    return conn
+
+
+def test_build_fts_query_quotes_terms_phrases_and_prefixes():
+    assert search.build_fts_query('pizza') == '"pizza"'
+    assert search.build_fts_query('"see you" tomo*') == '"see you" "tomo"*'
+    assert search.build_fts_query('AND OR NOT') == '"AND" "OR" "NOT"'
+    assert search.build_fts_query('a"b (c) -d') == '"ab" "(c)" "-d"'
+
+
+def test_build_fts_query_without_search_text():
+    assert search.build_fts_query('') is None
+    assert search.build_fts_query('  * "" ') is None
+
+
+def test_search_narrows_dates_to_an_id_range():
+    conn = _index([
+        ('2024-01-01 10:00', 'Alice', 'pizza tonight?'),
+        ('2024-01-02 10:00', 'Bob', 'pizza again'),
+        ('2024-01-03 10:00', 'Alice', 'no more pizza'),
+        ('2024-01-04 10:00', 'Bob', 'pizza pizza'),
+    ])
+
+    assert search._id_range(conn, pd.Timestamp('2024-01-02'), pd.Timestamp('2024-01-03 23:59')) == (2, 3)
+    results, total = search.search_messages(conn, 'pizza', start=pd.Timestamp('2024-01-02'), end=pd.Timestamp('2024-01-03 23:59'))
+    assert total == 2
+    assert results['message'].tolist() == ['no more pizza', 'pizza again']
+
+
+def test_search_range_outside_the_chat_matches_nothing():
+    conn = _index([('2024-01-01 10:00', 'Alice', 'pizza tonight?')])
+
+    results, total = search.search_messages(conn, 'pizza', start=pd.Timestamp('2025-01-01'))
+
+    assert total == 0 and results.empty
+
+
+def test_search_filters_senders_and_pages_newest_first():
+    conn = _index([(f'2024-01-01 10:{minute:02d}', 'Alice' if minute % 2 else 'Bob', f'hello {minute}') for minute in range(10)])
+
+    first, total = search.search_messages(conn, 'hel*', senders=['Alice'], page_size=2)
+    second, _ = search.search_messages(conn, 'hel*', senders=['Alice'], page=1, page_size=2)
+
+    assert total == 5
+    assert first['message'].tolist() == ['hello 9', 'hello 7']
+    assert second['message'].tolist() == ['hello 5', 'hello 3']
@@ -0,0 +1,92 @@
+import whatsapp_analyzer_core as core
+import whatsapp_analyzer_store as store
+
+# Longer than the IDENTITY_MESSAGES a chat is recognised by; "ok" repeats inside the overlap window
+OLDER = ''.join(f'15/01/2024, 10:{minute:02d} - Alice: message {minute}\n' for minute in range(55)) + (
+    '15/01/2024, 10:55 - Bob: ok\n'
+    '15/01/2024, 10:55 - Bob: ok\n'
+)
+NEWER = OLDER + (
+    '15/01/2024, 10:55 - Bob: ok\n'
+    + ''.join(f'15/01/2024, 11:{minute:02d} - Bob: reply {minute}\n' for minute in range(20))
+)
+
+
+def _save(text, root):
+    return store.save_stored_chat(core.parse_whatsapp_bytes(text.encode('utf-8')), 'chat.txt', root=root)
+
+
+def test_update_stored_chat_appends_only_messages_it_does_not_have(tmp_path):
+    root = str(tmp_path)
+    saved = _save(OLDER, root)
+
+    meta = store.match_stored_chat(NEWER.encode('utf-8'), root=root)
+    assert meta['chat_id'] == saved['chat_id']
+    meta, added = store.update_stored_chat(NEWER.encode('utf-8'), meta, root=root)
+
+    # The third identical "ok" at 10:55 is new; the two stored ones are not
+    assert added == 21
+    assert meta['rows'] == 57 + 21
+    stored = store.load_stored_chat(saved['chat_id'], root=root)
+    assert len(stored) == 78
+    assert (stored['message'] == 'ok').sum() == 3
+
+
+def test_update_stored_chat_with_the_same_export_adds_nothing(tmp_path):
+    root = str(tmp_path)
+    saved = _save(NEWER, root)
+
+    meta, added = store.update_stored_chat(NEWER.encode('utf-8'), saved, root=root)
+
+    assert added == 0
+    assert meta == saved
+    assert len(store.load_stored_chat(saved['chat_id'], root=root)) == 78
+
+
+def test_exports_of_one_chat_share_an_identity():
+    older_id, older_size = store.export_identity(OLDER.encode('utf-8'), 'older.txt')
+    newer_id, newer_size = store.export_identity(NEWER.encode('utf-8'), 'newer.txt')
+
+    assert older_id == newer_id
+    assert older_size < newer_size
+
+
+def test_import_exports_appends_later_exports_of_a_chat(tmp_path):
+    exports = [(OLDER.encode('utf-8'), 'older.txt'), (NEWER.encode('utf-8'), 'newer.txt')]
+
+    results = store.import_exports(exports, root=str(tmp_path))
+
+    assert [error for _, error in results] == [None, None]
+    (saved, saved_rows), (appended, appended_rows) = (result for result, _ in results)
+    assert (saved_rows, appended_rows) == (57, 21)
+    assert saved['chat_id'] == appended['chat_id']
+    assert len(store.load_stored_chat(appended['chat_id'], root=str(tmp_path))) == 78
+
+
+def test_import_exports_reports_an_export_without_messages(tmp_path):
+    results = store.import_exports([(b'not a chat\n', 'notes.txt')], root=str(tmp_path))
+
+    assert results == [(None, 'no messages found')]
+
+
+def test_stored_word_counts_follow_appends(tmp_path):
+    root = str(tmp_path)
+    saved = _save(OLDER, root)
+    store.update_stored_chat(NEWER.encode('utf-8'), saved, root=root)
+
+    stored = core.token_index_from_counts(store.load_stored_token_counts(saved['chat_id'], root=root))
+    parsed = core.build_token_index(core.parse_whatsapp_bytes(NEWER.encode('utf-8')))
+
+    assert sorted(core.top_words(stored, 100)) == sorted(core.top_words(parsed, 100))
+    assert ('reply', 20) in core.top_words(stored, 3)
+
+
+def test_word_counts_of_chats_saved_without_them_are_built_on_load(tmp_path):
+    root = str(tmp_path)
+    saved = _save(OLDER, root)
+    (tmp_path / saved['chat_id'] / 'tokens.parquet').unlink()
+
+    counts = store.load_stored_token_counts(saved['chat_id'], root=root)
+
+    assert (tmp_path / saved['chat_id'] / 'tokens.parquet').exists()
+    assert dict(core.top_words(core.token_index_from_counts(counts), 1)) == {'message': 55}
@@ -1,7 +1,6 @@
 
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import re
 import zipfile
 from datetime import datetime, date
@@ -1,7 +1,6 @@
 
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import re
 import zipfile
 from datetime import datetime, date
@@ -23,6 +22,10 @@ messages_by_hour_label = "הודעות לפי שעה" if is_hebrew else "Message
 messages_by_day_label = "הודעות לפי יום בשבוע" if is_hebrew else "Messages by Day of Week"
 messages_over_time_label = "שינויים בפעילות לפי משתתף" if is_hebrew else "User Activity Over Time"
 date_range_label = "בחר טווח תאריכים" if is_hebrew else "Select Date Range"
+others_label = "אחרים" if is_hebrew else "Others"
+
+# Senders drawn as their own line in the activity-over-time chart
+TOP_SENDERS_IN_CHART = 10
 
 st.title(title)
 uploaded_file = st.file_uploader(upload_text, type=["txt", "zip"])
@@ -56,8 +59,8 @@ if uploaded_file:
 
     df = pd.DataFrame(data, columns=["datetime", "sender", "message"])
     df["datetime"] = pd.to_datetime(df["datetime"], errors="coerce")
-    df = df.dropna(subset=["datetime"])
-    df["date"] = df["datetime"].dt.date
+    df = df.dropna(subset=["datetime"]).sort_values("datetime", kind="stable", ignore_index=True)
+    df["date"] = df["datetime"].dt.normalize()
     df["hour"] = df["datetime"].dt.hour
     df["weekday"] = df["datetime"].dt.day_name()
 
@@ -83,7 +86,10 @@ if uploaded_file:
     )
 
     if isinstance(selected_range, tuple):
-        df = df[(df["date"] >= selected_range[0]) & (df["date"] <= selected_range[1])]
+        # Rows are sorted by time, so the range is a slice between two binary-searched positions
+        start = df["date"].searchsorted(pd.Timestamp(selected_range[0]), side="left")
+        end = df["date"].searchsorted(pd.Timestamp(selected_range[1]), side="right")
+        df = df.iloc[start:end]
 
     # Overview
     st.subheader(overview_header)
@@ -97,7 +103,13 @@ if uploaded_file:
     hourly_activity = df.groupby("hour").size()
     weekday_order = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
     weekday_activity = df.groupby("weekday").size().reindex(weekday_order)
-    sender_time = df.groupby([df["datetime"].dt.date, "sender"]).size().unstack(fill_value=0)
+    # Per-sender activity: the top senders each get a line and everyone else is summed into one,
+    # at daily, weekly (labelled by their Monday) or monthly points depending on the span, so long and crowded chats stay light
+    top_senders = df["sender"].value_counts().index[:TOP_SENDERS_IN_CHART]
+    sender_group = df["sender"].where(df["sender"].isin(top_senders), others_label)
+    span_days = (df["datetime"].max() - df["datetime"].min()).days if len(df) else 0
+    freq = "D" if span_days <= 180 else "W-MON" if span_days <= 3 * 365 else "MS"
+    sender_time = df.groupby([pd.Grouper(key="datetime", freq=freq, closed="left", label="left"), sender_group]).size().unstack(fill_value=0)
 
     st.markdown("### " + messages_per_day_label)
     st.line_chart(daily_activity)
@@ -0,0 +1,247 @@
+"""Chat analysis shared by the Streamlit app and the batch CLI: leaderboards,
+time breakdowns, fact texts and cross-chat comparisons, with no UI dependency.
+"""
+import pandas as pd
+
+from whatsapp_analyzer_core import (
+    build_count_cube,
+    count_emojis,
+    cube_active_days,
+    cube_counts,
+    observed_counts,
+    sender_totals,
+)
+
+# Explanations shown after each fun fact
+FUN_FACT_EXPLANATIONS = {
+    'he': {
+        'top_chatter': 'מי שלח הכי הרבה הודעות בקבוצה',
+        'digger': 'מי שלח את ההודעה הכי ארוכה (הכי הרבה תווים)',
+        'emoji_king': "מי השתמש הכי הרבה באימוג'י",
+        'ghost': 'מי שלח הכי פחות הודעות (הכי שקט)',
+        'morning_champion': "מי אמר הכי הרבה 'בוקר טוב' או 'good morning'",
+        'sticker_addict': 'מי שלח הכי הרבה מדיה (תמונות, וידאו, סטיקרים)',
+    },
+    'en': {
+        'top_chatter': 'Who sent the most messages in the group',
+        'digger': 'Who sent the longest message (most characters)',
+        'emoji_king': 'Who used the most emojis',
+        'ghost': 'Who sent the least messages (quietest)',
+        'morning_champion': "Who said 'good morning' the most",
+        'sticker_addict': 'Who sent the most media (photos, videos, stickers)',
+    },
+}
+
+
+def create_leaderboards(df, cube):
+    """Create comprehensive leaderboards"""
+    leaderboards = {}
+
+    # 1. Most messages
+    user_message_counts = cube_counts(cube, 'sender')
+    leaderboards['most_messages'] = user_message_counts
+
+    # 2. Most emojis
+    leaderboards['most_emojis'] = count_emojis(df, top_k=10)['top']
+
+    # 3. Longest messages
+    longest_messages = df.nlargest(10, 'message_length')[['sender', 'message', 'message_length', 'datetime']]
+    leaderboards['longest_messages'] = longest_messages
+
+    # 4. Most media messages
+    media_counts = observed_counts(df.loc[df['is_media'], 'sender'])
+    leaderboards['most_media'] = media_counts
+
+    # 5. Most "haha" messages
+    haha_counts = observed_counts(df.loc[df['is_laugh'], 'sender'])
+    leaderboards['most_haha'] = haha_counts
+
+    return leaderboards
+
+
+def create_time_breakdowns(cube):
+    """Create time-based breakdowns from the (filtered) count cube"""
+    breakdowns = {}
+
+    # 1. Weekly breakdown (days of week), busiest first
+    weekday_counts = cube_counts(cube, 'weekday').sort_values(ascending=False, kind='stable')
+    breakdowns['weekly'] = weekday_counts
+
+    # 2. Monthly breakdown (days of month)
+    day_counts = cube_counts(cube, 'day_of_month')
+    breakdowns['monthly'] = day_counts
+
+    # 3. Hourly breakdown
+    hour_counts = cube_counts(cube, 'hour')
+    breakdowns['hourly'] = hour_counts
+
+    return breakdowns
+
+
+def create_user_stats(df, sender):
+    """Emoji and media totals and average message length of one sender"""
+    user_data = df[df['sender'] == sender]
+    return {
+        'emojis': int(user_data['emoji_count'].sum()),
+        'media': int(user_data['is_media'].sum()),
+        'avg_chars': user_data['message_length'].mean(),
+        'avg_words': user_data['word_count'].mean(),
+    }
+
+
+def get_interesting_facts(cube, breakdowns, leaderboards, is_hebrew=False):
+    """Generate interesting facts and insights"""
+    facts = []
+
+    total_messages = int(cube['messages'].sum())
+    if total_messages:
+        # Most active user percentage
+        most_active = leaderboards['most_messages'].index[0]
+        most_active_count = leaderboards['most_messages'].iloc[0]
+        most_active_percentage = (most_active_count / total_messages) * 100
+
+        facts.append(f"👑 {most_active} מהווה {most_active_percentage:.1f}% מההודעות בקבוצה" if is_hebrew else f"👑 {most_active} represents {most_active_percentage:.1f}% of all messages")
+
+        # Most active hour
+        most_active_hour = breakdowns['hourly'].idxmax()
+        facts.append(f"🕐 השעה הפעילה ביותר: {most_active_hour}:00" if is_hebrew else f"🕐 Most active hour: {most_active_hour}:00")
+
+        # Most active day
+        most_active_day = breakdowns['weekly'].idxmax()
+        facts.append(f"📅 היום הפעיל ביותר: {most_active_day}" if is_hebrew else f"📅 Most active day: {most_active_day}")
+
+        # Average messages per day
+        avg_per_day = total_messages / cube_active_days(cube)
+        facts.append(f"📊 ממוצע יומי: {avg_per_day:.1f} הודעות" if is_hebrew else f"📊 Daily average: {avg_per_day:.1f} messages")
+
+        # Most emoji user
+        if leaderboards['most_emojis']:
+            top_emoji = leaderboards['most_emojis'][0][0]
+            facts.append(f"😄 האימוג'י הפופולרי ביותר: {top_emoji}" if is_hebrew else f"😄 Most popular emoji: {top_emoji}")
+
+    return facts
+
+
+def create_fun_facts(df, leaderboards, is_hebrew=False):
+    """Create fun and humorous insights"""
+    facts = []
+    explanations = FUN_FACT_EXPLANATIONS['he' if is_hebrew else 'en']
+
+    if df.empty:
+        return facts
+
+    # Top chatter
+    top_chatter = leaderboards['most_messages'].index[0]
+    if is_hebrew:
+        facts.append(f"🏆 {top_chatter}: {leaderboards['most_messages'].iloc[0]} הודעות - {explanations['top_chatter']}")
+    else:
+        facts.append(f"🏆 {top_chatter}: {leaderboards['most_messages'].iloc[0]} messages - {explanations['top_chatter']}")
+
+    # The digger (longest message)
+    if not leaderboards['longest_messages'].empty:
+        digger = leaderboards['longest_messages'].iloc[0]
+        if is_hebrew:
+            facts.append(f"📚 {digger['sender']}: {digger['message_length']} תווים - {explanations['digger']}")
+        else:
+            facts.append(f"📚 {digger['sender']}: {digger['message_length']} characters - {explanations['digger']}")
+
+    # Per-sender emoji, greeting and media totals in one grouped pass
+    totals = sender_totals(df)
+
+    # Emoji king/queen
+    emoji_counts = totals['emoji_count']
+    if not emoji_counts.empty:
+        emoji_king = emoji_counts.idxmax()
+        if is_hebrew:
+            facts.append(f"👑 {emoji_king}: {emoji_counts[emoji_king]} אימוג'י - {explanations['emoji_king']}")
+        else:
+            facts.append(f"👑 {emoji_king}: {emoji_counts[emoji_king]} emojis - {explanations['emoji_king']}")
+
+    # The ghost (least active)
+    ghost = leaderboards['most_messages'].index[-1]
+    if is_hebrew:
+        facts.append(f"👻 {ghost}: {leaderboards['most_messages'].iloc[-1]} הודעות - {explanations['ghost']}")
+    else:
+        facts.append(f"👻 {ghost}: {leaderboards['most_messages'].iloc[-1]} messages - {explanations['ghost']}")
+
+    # Good morning champion
+    morning_counts = totals['is_greeting']
+    if not morning_counts.empty and morning_counts.max() > 0:
+        morning_champion = morning_counts.idxmax()
+        if is_hebrew:
+            facts.append(f"🌅 {morning_champion}: {morning_counts[morning_champion]} פעמים - {explanations['morning_champion']}")
+        else:
+            facts.append(f"🌅 {morning_champion}: {morning_counts[morning_champion]} times - {explanations['morning_champion']}")
+
+    # Sticker addict
+    sticker_counts = totals['is_media']
+    if not sticker_counts.empty and sticker_counts.max() > 0:
+        sticker_addict = sticker_counts.idxmax()
+        if is_hebrew:
+            facts.append(f"🎯 {sticker_addict}: {sticker_counts[sticker_addict]} מדיה - {explanations['sticker_addict']}")
+        else:
+            facts.append(f"🎯 {sticker_addict}: {sticker_counts[sticker_addict]} media - {explanations['sticker_addict']}")
+
+    return facts
+
+
+def analyze_chat(df, cube=None, is_hebrew=False):
+    """Leaderboards, time breakdowns and facts of a parsed chat, as the dashboard shows them"""
+    cube = build_count_cube(df) if cube is None else cube
+    leaderboards = create_leaderboards(df, cube)
+    breakdowns = create_time_breakdowns(cube)
+    return {
+        'cube': cube,
+        'leaderboards': leaderboards,
+        'breakdowns': breakdowns,
+        'facts': get_interesting_facts(cube, breakdowns, leaderboards, is_hebrew),
+        'fun_facts': create_fun_facts(df, leaderboards, is_hebrew),
+    }
+
+
+def chat_summary(counts):
+    """Per-chat aggregates a cross-chat comparison is built from, reduced once from count_messages output.
+
+    daily has every day from the first to the last message (zero when quiet);
+    senders is the message total per sender, largest first.
+    """
+    daily = counts.groupby('day')['messages'].sum()
+    if len(daily):
+        daily = daily.asfreq('D', fill_value=0)
+    senders = counts.groupby(counts['sender'].astype(str))['messages'].sum()
+    return {'daily': daily, 'senders': senders.sort_values(ascending=False, kind='stable')}
+
+
+def compare_chats(summaries):
+    """Cross-chat tables from the chat_summary of each chat, keyed by chat label.
+
+    Returns:
+        leaderboard  one row per chat: messages, participants, active days,
+                     messages per active day, first and last day, top sender
+        overlap      members shared by each pair of chats (participants on the diagonal)
+        members      senders found in more than one chat, with their chat count and total messages
+    Only the per-chat aggregates are read, so the cost grows with senders and
+    days, never with messages.
+    """
+    labels = list(summaries)
+    leaderboard = pd.DataFrame({
+        'messages': [int(summary['senders'].sum()) for summary in summaries.values()],
+        'participants': [len(summary['senders']) for summary in summaries.values()],
+        'active_days': [int((summary['daily'] > 0).sum()) for summary in summaries.values()],
+        'first_day': [summary['daily'].index.min() for summary in summaries.values()],
+        'last_day': [summary['daily'].index.max() for summary in summaries.values()],
+        'top_sender': [summary['senders'].index[0] if len(summary['senders']) else None for summary in summaries.values()],
+    }, index=pd.Index(labels, name='chat'))
+    leaderboard.insert(3, 'messages_per_day', (leaderboard['messages'] / leaderboard['active_days'].clip(lower=1)).round(1))
+    leaderboard = leaderboard.sort_values('messages', ascending=False, kind='stable')
+
+    # Sender x chat message totals; a member of a chat is a sender with messages in it
+    messages = pd.DataFrame({label: summary['senders'] for label, summary in summaries.items()}, columns=labels)
+    membership = messages.notna().to_numpy(dtype='int64')
+    overlap = pd.DataFrame(membership.T @ membership, index=labels, columns=labels)
+    members = pd.DataFrame({
+        'chats': membership.sum(axis=1),
+        'messages': messages.sum(axis=1).astype('int64'),
+    }, index=messages.index.rename('sender'))
+    members = members[members['chats'] > 1].sort_values(['chats', 'messages'], ascending=False, kind='stable')
+    return {'leaderboard': leaderboard, 'overlap': overlap, 'members': members}
@@ -0,0 +1,221 @@
+"""Headless batch analysis of a directory of WhatsApp exports.
+
+Every .txt/.zip export is parsed and analyzed in a process pool. Each chat
+gets <out>/<export name>/ (dots as underscores, -2, -3... on clashes) with report.json (leaderboards, time breakdowns,
+facts, and for zips the attached media by kind), senders.parquet (per-sender
+stats, with attachment files and bytes for zips) and activity.parquet
+(messages per day, hour and sender); summary.parquet lists every export with
+its timings.
+
+Usage: python whatsapp_analyzer_batch.py EXPORT_DIR [--out batch_output] [--workers N] [--language en|he]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from whatsapp_analyzer_analysis import analyze_chat
+from whatsapp_analyzer_core import (
+    count_messages,
+    media_by_sender,
+    open_txt_from_zip,
+    parse_whatsapp_stream,
+    read_media_manifest,
+)
+
+EXPORT_SUFFIXES = ('.txt', '.zip')
+
+
+def find_exports(export_dir):
+    """Paths of the .txt/.zip exports directly inside export_dir, sorted by name"""
+    return sorted(
+        os.path.join(export_dir, name) for name in os.listdir(export_dir)
+        if name.lower().endswith(EXPORT_SUFFIXES) and os.path.isfile(os.path.join(export_dir, name))
+    )
+
+
+def output_dir_names(paths):
+    """Output directory name of each export: its file name with dots as underscores, plus -2, -3... where that clashes"""
+    names, taken = [], set()
+    for path in paths:
+        base = name = os.path.basename(path).replace('.', '_')
+        n = 1
+        # Compared case-insensitively, for case-insensitive file systems
+        while name.lower() in taken:
+            n += 1
+            name = f'{base}-{n}'
+        taken.add(name.lower())
+        names.append(name)
+    return names
+
+
+def _counts_json(series):
+    return {str(key): int(value) for key, value in series.items()}
+
+
+def _report(path, df, analysis, manifest=None):
+    leaderboards = analysis['leaderboards']
+    breakdowns = analysis['breakdowns']
+    longest = leaderboards['longest_messages']
+    report = {
+        'file': os.path.basename(path),
+        'messages': len(df),
+        'participants': int(df['sender'].nunique()),
+        'first_timestamp': df['datetime'].min().isoformat() if len(df) else None,
+        'last_timestamp': df['datetime'].max().isoformat() if len(df) else None,
+        'timestamp_format': df.attrs.get('timestamp_format'),
+        'leaderboards': {
+            'most_messages': _counts_json(leaderboards['most_messages']),
+            'most_emojis': [[emoji, int(count)] for emoji, count in leaderboards['most_emojis']],
+            'longest_messages': [
+                {'sender': str(sender), 'message': message, 'length': int(length), 'datetime': timestamp.isoformat()}
+                for sender, message, length, timestamp in zip(
+                    longest['sender'], longest['message'], longest['message_length'], longest['datetime']
+                )
+            ],
+            'most_media': _counts_json(leaderboards['most_media']),
+            'most_haha': _counts_json(leaderboards['most_haha']),
+        },
+        'breakdowns': {name: _counts_json(counts) for name, counts in breakdowns.items()},
+        'facts': analysis['facts'],
+        'fun_facts': analysis['fun_facts'],
+    }
+    if manifest is not None:
+        by_kind = manifest.groupby('kind', observed=True)['bytes'].agg(['size', 'sum'])
+        report['media'] = {str(kind): {'files': int(files), 'bytes': int(total)} for kind, (files, total) in by_kind.iterrows()}
+    return report
+
+
+def _sender_stats(df, manifest=None):
+    stats = df.groupby('sender', observed=True).agg(
+        messages=('message', 'size'),
+        avg_length=('message_length', 'mean'),
+        avg_words=('word_count', 'mean'),
+        emojis=('emoji_count', 'sum'),
+        media=('is_media', 'sum'),
+        laughs=('is_laugh', 'sum'),
+        greetings=('is_greeting', 'sum'),
+        first_message=('datetime', 'min'),
+        last_message=('datetime', 'max'),
+    )
+    stats.index = stats.index.astype(str)
+    if manifest is not None:
+        attached = media_by_sender(df, manifest).rename(columns={'files': 'media_files', 'bytes': 'media_bytes'})
+        stats = stats.join(attached).fillna({'media_files': 0, 'media_bytes': 0}).astype({'media_files': 'int64', 'media_bytes': 'int64'})
+    return stats.sort_values('messages', ascending=False).reset_index()
+
+
+def analyze_export(path, out_dir, is_hebrew=False, output_name=None):
+    """Parse, analyze and write one export; returns its summary row (with an error instead on failure).
+
+    Results go to <out_dir>/<output_name>, by default the file name with dots as underscores.
+    """
+    output_name = output_name or output_dir_names([path])[0]
+    row = {'file': os.path.basename(path), 'output': output_name, 'bytes': os.path.getsize(path), 'messages': 0, 'error': None}
+    started = time.perf_counter()
+    manifest = None
+    try:
+        if path.lower().endswith('.zip'):
+            # Before the chat stream is opened, so a bad archive can't leave it open
+            manifest = read_media_manifest(path)
+            stream, _ = open_txt_from_zip(path)
+            if stream is None:
+                raise ValueError('no .txt chat file in the archive')
+        else:
+            stream = open(path, 'rb')
+        with stream:
+            df = parse_whatsapp_stream(stream)
+        if df.empty:
+            raise ValueError('no messages found')
+        parsed = time.perf_counter()
+
+        analysis = analyze_chat(df, is_hebrew=is_hebrew)
+        analyzed = time.perf_counter()
+
+        chat_dir = os.path.join(out_dir, output_name)
+        os.makedirs(chat_dir, exist_ok=True)
+        with open(os.path.join(chat_dir, 'report.json'), 'w', encoding='utf-8') as f:
+            json.dump(_report(path, df, analysis, manifest), f, ensure_ascii=False, indent=2)
+        _sender_stats(df, manifest).to_parquet(os.path.join(chat_dir, 'senders.parquet'), index=False)
+        count_messages(df).astype({'sender': str}).to_parquet(os.path.join(chat_dir, 'activity.parquet'), index=False)
+        written = time.perf_counter()
+
+        row.update(
+            messages=len(df),
+            participants=int(df['sender'].nunique()),
+            first_timestamp=df['datetime'].min() if len(df) else pd.NaT,
+            last_timestamp=df['datetime'].max() if len(df) else pd.NaT,
+            parse_seconds=parsed - started,
+            analysis_seconds=analyzed - parsed,
+            write_seconds=written - analyzed,
+        )
+    except Exception:
+        row['error'] = traceback.format_exc(limit=3)
+    row['seconds'] = time.perf_counter() - started
+    return row
+
+
+def run_batch(export_dir, out_dir, workers=None, is_hebrew=False, progress=print):
+    """Analyze every export of export_dir across a process pool; returns the summary table.
+
+    Per-file timings are reported through progress as files finish, and the
+    summary is also written to <out_dir>/summary.parquet.
+    """
+    paths = find_exports(export_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths) or 1))
+    started = time.perf_counter()
+    rows = []
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [
+            pool.submit(analyze_export, path, out_dir, is_hebrew, name)
+            for path, name in zip(paths, output_dir_names(paths))
+        ]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            if row['error']:
+                progress(f"FAILED {row['file']}: {row['error'].strip().splitlines()[-1]}")
+            else:
+                progress(f"{row['file']}: {row['messages']:,} messages in {row['seconds']:.2f}s "
+                         f"(parse {row['parse_seconds']:.2f}s, analysis {row['analysis_seconds']:.2f}s, "
+                         f"write {row['write_seconds']:.2f}s)")
+    elapsed = time.perf_counter() - started
+
+    summary = pd.DataFrame(rows)
+    if not summary.empty:
+        summary = summary.sort_values('file', ignore_index=True)
+        summary.to_parquet(os.path.join(out_dir, 'summary.parquet'), index=False)
+    summary.attrs['elapsed_seconds'] = elapsed
+    summary.attrs['workers'] = workers
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('export_dir')
+    parser.add_argument('--out', default='batch_output')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--language', choices=('en', 'he'), default='en', help='language of the fact texts')
+    args = parser.parse_args()
+
+    summary = run_batch(args.export_dir, args.out, args.workers, args.language == 'he')
+    if summary.empty:
+        print(f"No .txt/.zip exports in {args.export_dir}")
+        return
+    elapsed = summary.attrs['elapsed_seconds']
+    ok = summary[summary['error'].isna()]
+    print(f"\n{len(ok)}/{len(summary)} exports, {ok['messages'].sum():,} messages, "
+          f"{summary['bytes'].sum() / 2**20:.1f}MB in {elapsed:.2f}s with {summary.attrs['workers']} worker(s): "
+          f"{len(summary) / elapsed:.2f} files/sec, {ok['messages'].sum() / elapsed:,.0f} messages/sec")
+    print(f"Results in {args.out}/ (summary.parquet)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Benchmarks for the WhatsApp analyzer core.
+
+Every stage of the dashboard pipeline (parse, count cube, leaderboards, time
+breakdowns, facts, fun facts) is timed on seeded synthetic exports, for any
+mix of sizes, line formats and clocks. --save appends the results to a JSON
+lines file and --compare prints the ratio against the latest matching result
+of such a file, so runs on different commits can be compared.
+
+Usage: python whatsapp_analyzer_bench.py [--lines 10000,1000000] [--format standard|all] [--clock 24h,12h] [--seed 0]
+       [--save bench_results.jsonl] [--compare bench_results.jsonl] [--workers 1,2,4,8] [--emojis]
+       [--senders 10,100,1000] [--imports]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from whatsapp_analyzer_analysis import create_fun_facts, create_leaderboards, create_time_breakdowns, get_interesting_facts
+from whatsapp_analyzer_core import (
+    build_count_cube,
+    count_emojis,
+    parse_whatsapp_bytes,
+    parse_whatsapp_content,
+    sender_totals,
+)
+
+SENDERS = ['Dana', 'Avi Cohen', 'Noa', 'יוסי', 'Michal Levi', '+972 50-123-4567']
+TEXTS = [
+    'בוקר טוב לכולם', 'Good morning!', 'חחחח מעולה', 'haha 😂😂', '<Media omitted>',
+    'ok', 'see you tomorrow 👍🏽', 'מישהו יודע מתי הפגישה?', 'lol', 'sticker omitted',
+    'מזל טוב!! 🎉🎂👨‍👩‍👧‍👦', 'go 🇮🇱 ❤️❤️', 'room 1️⃣ 👩🏾‍💻',
+]
+
+# Line prefix per supported format, filled from a datetime
+LINE_TEMPLATES = {
+    'standard': '{t:%d/%m/%Y}, {t:%H:%M} - {sender}: {text}',
+    'bracket': '[{t:%d/%m/%Y}, {t:%H:%M:%S}] {sender}: {text}',
+    'no_comma': '{t:%d/%m/%Y} {t:%H:%M} - {sender}: {text}',
+    'iso': '{t:%Y-%m-%d} {t:%H:%M} - {sender}: {text}',
+    'dotted': '{t:%d.%m.%Y} {t:%H:%M} - {sender}: {text}',
+}
+CLOCKS = ('24h', '12h')
+
+# Cold import budget per UI-free module, in milliseconds of `python -X importtime` cumulative time.
+# pandas alone is ~200ms of it; anything UI-side must stay out of these imports.
+IMPORT_BUDGET_MS = {
+    'whatsapp_analyzer_core': 400,
+    'whatsapp_analyzer_analysis': 400,
+    'whatsapp_analyzer_search': 400,
+    'whatsapp_analyzer_store': 450,
+    'whatsapp_analyzer_batch': 450,
+}
+# Heavy modules that are imported lazily, on first use
+LAZY_MODULES = ('streamlit', 'plotly', 'matplotlib', 'emoji')
+
+
+def generate_export(n_lines, line_format='standard', seed=0, multiline_ratio=0.05, n_senders=None, clock='24h'):
+    """Build a synthetic export of roughly n_lines lines, reproducible for a given seed.
+
+    n_senders replaces the default sender names with that many numbered members;
+    clock='12h' writes times as 8:30 PM instead of 20:30.
+    """
+    rng = random.Random(seed)
+    template = LINE_TEMPLATES[line_format]
+    if clock == '12h':
+        template = re.sub(r'%H(:%M(?::%S)?)', r'%I\1 %p', template)
+    senders = SENDERS if n_senders is None else [f'Member {i}' for i in range(n_senders)]
+    timestamp = datetime(2020, 1, 1, 8, 0)
+    lines = []
+    while len(lines) < n_lines:
+        timestamp += timedelta(seconds=rng.randint(5, 3600))
+        lines.append(template.format(t=timestamp, sender=rng.choice(senders), text=rng.choice(TEXTS)))
+        if rng.random() < multiline_ratio:
+            lines.append(rng.choice(TEXTS))
+    return '\n'.join(lines)
+
+
+def _best_of(run, repeat):
+    """(result of the last call, best wall time) over repeat calls of run"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def bench_stages(content, repeat=3):
+    """Best-of-repeat wall time of each dashboard stage, fed by the previous stages' output.
+
+    Returns {'lines', 'messages', 'stages': {stage: seconds}}.
+    """
+    stages = {}
+    df, stages['parse'] = _best_of(lambda: parse_whatsapp_content(content), repeat)
+    cube, stages['count_cube'] = _best_of(lambda: build_count_cube(df), repeat)
+    leaderboards, stages['leaderboards'] = _best_of(lambda: create_leaderboards(df, cube), repeat)
+    breakdowns, stages['time_breakdowns'] = _best_of(lambda: create_time_breakdowns(cube), repeat)
+    _, stages['facts'] = _best_of(lambda: get_interesting_facts(cube, breakdowns, leaderboards), repeat)
+    _, stages['fun_facts'] = _best_of(lambda: create_fun_facts(df, leaderboards), repeat)
+    return {'lines': content.count('\n') + 1, 'messages': len(df), 'stages': stages}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, results):
+    """Append results to a JSON lines file, one record per (format, clock, lines, stage)"""
+    run = {'run_at': datetime.now().isoformat(timespec='seconds'), 'commit': _git_commit(),
+           'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()}
+    with open(path, 'a', encoding='utf-8') as f:
+        for result in results:
+            for stage, seconds in result['stages'].items():
+                record = dict(run, format=result['format'], clock=result['clock'], lines=result['lines'],
+                              messages=result['messages'], stage=stage, seconds=seconds)
+                f.write(json.dumps(record) + '\n')
+
+
+def load_baseline(path):
+    """Latest saved seconds per (format, clock, lines, stage) of a results file"""
+    baseline = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            baseline[(record['format'], record['clock'], record['lines'], record['stage'])] = record
+    return baseline
+
+
+def bench_workers(data, worker_counts, repeat=3):
+    """Best-of-repeat parse_whatsapp_bytes time per worker count, forcing the sharded path"""
+    results = []
+    for workers in worker_counts:
+        # Warm the pool so process start-up isn't counted
+        parse_whatsapp_bytes(data[:1024], workers=workers, parallel_threshold=0)
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse_whatsapp_bytes(data, workers=workers, parallel_threshold=0)
+            best = min(best, time.perf_counter() - start)
+        results.append({'workers': workers, 'seconds': best})
+    return results
+
+
+def bench_emojis(df, repeat=3):
+    """Best-of-repeat time of count_emojis against per-message emoji.emoji_list, with a result check"""
+    import emoji
+
+    def emoji_list_top():
+        found = []
+        for message in df['message']:
+            found.extend(emoji.emoji_list(message))
+        return Counter(e['emoji'] for e in found).most_common(10)
+
+    results = {}
+    for name, run in (('emoji_list', emoji_list_top), ('count_emojis', lambda: count_emojis(df)['top'])):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            top = run()
+            best = min(best, time.perf_counter() - start)
+        results[name] = {'seconds': best, 'top': dict(top)}
+    results['match'] = results['emoji_list']['top'] == results['count_emojis']['top']
+    return results
+
+
+def bench_sender_totals(df, repeat=3):
+    """Best-of-repeat time of the grouped per-sender fun-fact totals against one boolean mask per sender"""
+    columns = ['emoji_count', 'is_greeting', 'is_media']
+
+    def masked():
+        return {column: {sender: df[df['sender'] == sender][column].sum() for sender in df['sender'].unique()}
+                for column in columns}
+
+    results = {}
+    for name, run in (('masked', masked), ('grouped', lambda: sender_totals(df, columns))):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        results[name] = best
+    return results
+
+
+def bench_imports(modules=IMPORT_BUDGET_MS, repeat=3):
+    """Best-of-repeat cold import time of each module in a fresh interpreter, with the lazy modules it pulled in"""
+    check = f"import sys; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    results = []
+    for module in modules:
+        best = float('inf')
+        for _ in range(repeat):
+            # Run from this file's directory so the repo modules import wherever the bench was started
+            run = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}; {check}'],
+                                 capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            # Last importtime line is the module itself: "import time: self | cumulative | name"
+            own = [line for line in run.stderr.splitlines() if line.rstrip().endswith(f'| {module}')][-1]
+            best = min(best, int(own.split('|')[1]) / 1000)
+        eager = [name for name in run.stdout.strip().split(',') if name]
+        results.append({'module': module, 'ms': best, 'budget_ms': modules[module], 'eager': eager})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', default='200000', help='comma separated export sizes in lines')
+    parser.add_argument('--format', default='standard', help=f"comma separated line formats or 'all' ({', '.join(LINE_TEMPLATES)})")
+    parser.add_argument('--clock', default='24h', help="comma separated clocks: 24h, 12h")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage; the best one counts')
+    parser.add_argument('--save', help='append the stage results to this JSON lines file')
+    parser.add_argument('--compare', help='JSON lines file of an earlier --save to compare against')
+    parser.add_argument('--workers', default='', help='comma separated worker counts for the sharded parser')
+    parser.add_argument('--emojis', action='store_true', help='benchmark bulk emoji counting against emoji.emoji_list')
+    parser.add_argument('--senders', default='', help='comma separated member counts for the per-sender fun facts')
+    parser.add_argument('--imports', action='store_true',
+                        help='check cold import times against IMPORT_BUDGET_MS (exits 1 when over budget)')
+    args = parser.parse_args()
+
+    if args.imports:
+        over = False
+        for row in bench_imports():
+            ok = row['ms'] <= row['budget_ms'] and not row['eager']
+            over |= not ok
+            print(f"import {row['module']}: {row['ms']:.0f}ms (budget {row['budget_ms']}ms)"
+                  + (f", eagerly imports {', '.join(row['eager'])}" if row['eager'] else '')
+                  + ('' if ok else '  OVER BUDGET'))
+        sys.exit(1 if over else 0)
+
+    sizes = [int(n) for n in args.lines.split(',')]
+    formats = list(LINE_TEMPLATES) if args.format == 'all' else args.format.split(',')
+    clocks = args.clock.split(',')
+    for name in formats:
+        if name not in LINE_TEMPLATES:
+            parser.error(f"unknown format {name!r}")
+    for clock in clocks:
+        if clock not in CLOCKS:
+            parser.error(f"unknown clock {clock!r}")
+    baseline = load_baseline(args.compare) if args.compare else {}
+
+    results = []
+    for n_lines in sizes:
+        for line_format in formats:
+            for clock in clocks:
+                content = generate_export(n_lines, line_format, args.seed, clock=clock)
+                result = dict(bench_stages(content, args.repeat), format=line_format, clock=clock)
+                results.append(result)
+                print(f"[{line_format} {clock}] {result['lines']:,} lines -> {result['messages']:,} messages")
+                for stage, seconds in result['stages'].items():
+                    previous = baseline.get((line_format, clock, result['lines'], stage))
+                    change = (f"  x{previous['seconds'] / seconds:.2f} vs {previous['commit'] or previous['run_at']}"
+                              if previous else '')
+                    print(f"  {stage:<16}{seconds:9.4f}s {result['lines'] / seconds:>16,.0f} lines/sec{change}")
+    if args.save:
+        save_results(args.save, results)
+        print(f"Results appended to {args.save}")
+
+    # The remaining benchmarks run on the first size, format and clock
+    if args.workers or args.emojis:
+        content = generate_export(sizes[0], formats[0], args.seed, clock=clocks[0])
+
+    if args.workers:
+        worker_counts = [int(w) for w in args.workers.split(',')]
+        scaling = bench_workers(content.encode('utf-8'), worker_counts)
+        base = scaling[0]['seconds']
+        for row in scaling:
+            print(f"parse_whatsapp_bytes workers={row['workers']}: {row['seconds']:.3f}s "
+                  f"(x{base / row['seconds']:.2f} vs {scaling[0]['workers']} worker(s))")
+
+    if args.emojis:
+        emojis = bench_emojis(parse_whatsapp_content(content))
+        per_message, bulk = emojis['emoji_list']['seconds'], emojis['count_emojis']['seconds']
+        print(f"emoji counting: emoji_list {per_message:.3f}s, count_emojis {bulk:.3f}s "
+              f"(x{per_message / bulk:.1f}), same top 10: {emojis['match']}")
+
+    for n_senders in (int(n) for n in args.senders.split(',') if n):
+        df = parse_whatsapp_content(generate_export(sizes[0], formats[0], args.seed, n_senders=n_senders, clock=clocks[0]))
+        totals = bench_sender_totals(df)
+        print(f"fun facts per sender, {n_senders} senders: masked {totals['masked']:.3f}s, "
+              f"grouped {totals['grouped']:.4f}s (x{totals['masked'] / totals['grouped']:.0f})")
+
+
+if __name__ == '__main__':
+    main()
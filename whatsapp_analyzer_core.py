@@ -0,0 +1,1063 @@
+import codecs
+import functools
+import io
+import multiprocessing
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, islice
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Shared time fragment: 20:30, 20:30:15, 8:30 PM, 8:30:15 PM
+_TIME = r'(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AP]M)?)'
+# Optional "Sender: " part - when absent the line is a system message
+_BODY = r'(?:([^:]+):\s*)?(.*)'
+
+# Supported WhatsApp export line formats, in detection priority order
+LINE_FORMATS = {
+    # Standard format: 29/07/2025, 20:30 - User: Message (also matches the no comma variant)
+    'standard': re.compile(r'(\d{1,2}/\d{1,2}/\d{2,4}),?\s+' + _TIME + r'\s*-\s*' + _BODY),
+    # Bracket format: [29/07/2025, 20:30] User: Message
+    'bracket': re.compile(r'\[(\d{1,2}/\d{1,2}/\d{2,4}),?\s+' + _TIME + r'\]\s*' + _BODY),
+    # No comma format: 29/07/2025 20:30 - User: Message
+    'no_comma': re.compile(r'(\d{1,2}/\d{1,2}/\d{2,4})\s+' + _TIME + r'\s*-\s*' + _BODY),
+    # ISO format: 2025-07-29 20:30 - User: Message
+    'iso': re.compile(r'(\d{4}-\d{1,2}-\d{1,2})\s+' + _TIME + r'\s*-\s*' + _BODY),
+    # Alternative format: 29.07.2025 20:30 - User: Message
+    'dotted': re.compile(r'(\d{1,2}\.\d{1,2}\.\d{2,4})\s+' + _TIME + r'\s*-\s*' + _BODY),
+}
+
+# Number of leading non-empty lines inspected when detecting the export format
+FORMAT_SAMPLE_LINES = 200
+
+# Direction marks iOS puts before attachment lines: "\u200e[15/01/2024, 10:22:33] Bob: \u200e<attached: ...>"
+DIRECTION_MARKS = '\u200e\u200f'
+
+
+def clean_line(line):
+    """Line stripped of surrounding whitespace and leading direction marks, ready for LINE_FORMATS"""
+    return line.strip().lstrip(DIRECTION_MARKS).lstrip()
+
+# Compact message schema produced by every parse path (see apply_message_schema),
+# with rows sorted by datetime so date ranges are positional slices (see filter_date_range):
+#   datetime        datetime64 (int64 backed)
+#   day             datetime64, datetime at midnight
+#   sender          category
+#   message         string[pyarrow]
+#   message_length  int32
+#   weekday         ordered category (Monday..Sunday)
+#   day_of_month    int8
+#   hour            int8
+# plus the per-message features of message_features:
+#   emoji_count     int32
+#   word_count      int32
+#   is_media        bool
+#   is_laugh        bool
+#   is_greeting     bool
+MESSAGE_DTYPE = pd.StringDtype('pyarrow')
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+WEEKDAY_DTYPE = pd.CategoricalDtype(WEEKDAY_NAMES, ordered=True)
+
+
+# Attachments: "<Media omitted>", "<המדיה לא נכללה>", "<attached: ...>" and iOS "image omitted" style lines
+MEDIA_PATTERN = r'<[^<>]+>|\b(?:image|video|audio|sticker|GIF|document|Media) omitted\b|\(file attached\)'
+LAUGH_PATTERN = r'חחח|haha|ההה|lol'
+GREETING_PATTERN = r'בוקר|morning'
+FEATURE_COLUMNS = ['emoji_count', 'word_count', 'is_media', 'is_laugh', 'is_greeting']
+
+
+def _trie_pattern(words):
+    """Regex matching any of words, prefix-factored so longer words win and the automaton stays small"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        singles = [re.escape(char) for char, child in sorted(node.items()) if char and list(child) == ['']]
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char and list(child) != ['']]
+        if len(singles) > 1:
+            branches.append('[' + ''.join(singles) + ']')
+        else:
+            branches.extend(singles)
+        if not branches:
+            return ''
+        optional = '' in node
+        body = branches[0] if len(branches) == 1 and not optional else '(?:' + '|'.join(branches) + ')'
+        return body + ('?' if optional else '')
+
+    return build(trie)
+
+
+@functools.lru_cache(maxsize=None)
+def emoji_pattern():
+    """Regex matching one emoji as the emoji package defines them.
+
+    Built once from emoji.EMOJI_DATA, so ZWJ sequences, skin tones, keycaps and
+    flags count as a single emoji, like emoji.emoji_list. A flat alternation of
+    the ~5000 sequences is far too slow for RE2; the trie form runs at column speed.
+    """
+    import emoji
+    return _trie_pattern(emoji.EMOJI_DATA)
+
+
+@functools.lru_cache(maxsize=None)
+def _emoji_run_pattern():
+    """Regex matching runs of characters that never occur in an emoji sequence"""
+    import emoji
+    codepoints = sorted({ord(char) for sequence in emoji.EMOJI_DATA for char in sequence})
+    ranges = []
+    for codepoint in codepoints:
+        if ranges and ranges[-1][1] == codepoint - 1:
+            ranges[-1][1] = codepoint
+        else:
+            ranges.append([codepoint, codepoint])
+    char_class = ''.join(re.escape(chr(lo)) + ('-' + re.escape(chr(hi)) if hi > lo else '') for lo, hi in ranges)
+    return '[^' + char_class + ']+'
+
+
+def count_emojis(df, top_k=10):
+    """Count every emoji of a message frame in bulk.
+
+    Only messages with a non-zero emoji_count are looked at; one arrow pass
+    collapses everything that can't be part of an emoji to a space. Those
+    leftovers repeat heavily ("😂", "👍🏽"), so they are counted per sender first
+    and the emoji matcher runs once per distinct leftover. Returns a dict with
+        top         [(emoji, count), ...] for the top_k emojis overall
+        per_sender  DataFrame of sender, emoji, count, most used first
+    """
+    with_emojis = df.loc[df['emoji_count'] > 0, ['sender', 'message']]
+    leftovers = pd.DataFrame({
+        'sender': with_emojis['sender'].to_numpy(),
+        'leftover': with_emojis['message'].str.replace(_emoji_run_pattern(), ' ', regex=True).to_numpy(),
+    })
+    pairs = leftovers.groupby(['sender', 'leftover'], observed=True).size().rename('times').reset_index()
+
+    matcher = re.compile(emoji_pattern())
+    distinct = pd.DataFrame({'leftover': pairs['leftover'].unique()})
+    distinct['emoji'] = [matcher.findall(text) for text in distinct['leftover']]
+    found = pairs.merge(distinct.explode('emoji').dropna(subset=['emoji']), on='leftover')
+
+    per_sender = found.groupby(['sender', 'emoji'], observed=True)['times'].sum().rename('count').reset_index()
+    per_sender = per_sender.sort_values('count', ascending=False, kind='stable', ignore_index=True)
+    totals = per_sender.groupby('emoji')['count'].sum().sort_values(ascending=False, kind='stable')
+    return {
+        'top': list(zip(totals.index[:top_k], totals.to_numpy()[:top_k].tolist())),
+        'per_sender': per_sender,
+    }
+
+
+def message_features(message):
+    """Per-message feature columns of a string[pyarrow] message column, each a single vectorized pass"""
+    return {
+        'emoji_count': message.str.count(emoji_pattern()).fillna(0).astype('int32'),
+        'word_count': message.str.count(r'\S+').fillna(0).astype('int32'),
+        'is_media': message.str.contains(MEDIA_PATTERN, case=False).fillna(False).astype(bool),
+        'is_laugh': message.str.contains(LAUGH_PATTERN, case=False).fillna(False).astype(bool),
+        'is_greeting': message.str.contains(GREETING_PATTERN, case=False).fillna(False).astype(bool),
+    }
+
+
+def apply_message_schema(df):
+    """Convert a datetime/sender/message frame to the compact schema, adding calendar fields and message features"""
+    timestamps = df['datetime']
+    message = df['message'].astype(MESSAGE_DTYPE)
+    return pd.DataFrame({
+        'datetime': timestamps,
+        'day': timestamps.dt.normalize(),
+        'sender': df['sender'].astype('category'),
+        'message': message,
+        'message_length': message.str.len().fillna(0).astype('int32'),
+        'weekday': pd.Categorical.from_codes(timestamps.dt.dayofweek.to_numpy(), dtype=WEEKDAY_DTYPE),
+        'day_of_month': timestamps.dt.day.astype('int8'),
+        'hour': timestamps.dt.hour.astype('int8'),
+        **message_features(message),
+    })
+
+
+def empty_messages():
+    """A zero-row frame with the compact message schema"""
+    return apply_message_schema(pd.DataFrame({
+        'datetime': pd.Series([], dtype='datetime64[ns]'),
+        'sender': pd.Series([], dtype=object),
+        'message': pd.Series([], dtype=object),
+    }))
+
+
+def count_messages(df):
+    """Long-form message counts per (day, hour, sender)"""
+    counts = df.groupby(['day', 'hour', 'sender'], observed=True).size()
+    return counts.rename('messages').reset_index()
+
+
+def merge_counts(*counts):
+    """Add long-form count tables from count_messages"""
+    merged = pd.concat(counts, ignore_index=True).astype({'sender': str})
+    merged = merged.groupby(['day', 'hour', 'sender'], as_index=False)['messages'].sum()
+    return merged.astype({'sender': 'category'})
+
+
+def cube_from_counts(counts):
+    """Build the (sender x day x hour) count cube from long-form count_messages output.
+
+    The cube is stored sparse, one entry per non-empty cell sorted by day, so it
+    never grows past the message count and a date range is a contiguous slice:
+        senders   Index of sender names (codes index into it)
+        days      contiguous daily DatetimeIndex from first to last day
+        day       int32 offset into days, ascending
+        hour      int8
+        sender    int32 sender code
+        messages  int32 message count of the cell
+    """
+    senders = pd.Index(pd.unique(counts['sender'].astype(str)))
+    if counts.empty:
+        days = pd.DatetimeIndex([])
+    else:
+        days = pd.date_range(counts['day'].min(), counts['day'].max(), freq='D')
+    counts = counts.sort_values(['day', 'hour'], kind='stable')
+    return {
+        'senders': senders,
+        'days': days,
+        'day': ((counts['day'] - days[0]).dt.days.to_numpy(dtype='int32') if len(days) else np.zeros(0, 'int32')),
+        'hour': counts['hour'].to_numpy(dtype='int8'),
+        'sender': senders.get_indexer(counts['sender'].astype(str)).astype('int32'),
+        'messages': counts['messages'].to_numpy(dtype='int32'),
+    }
+
+
+def build_count_cube(df):
+    """Count cube of a parsed chat (see cube_from_counts); built once per parse"""
+    return cube_from_counts(count_messages(df))
+
+
+def slice_cube(cube, start=None, end=None, senders=None):
+    """Cube (or token index) restricted to days in [start, end] and, if given, to the listed sender names"""
+    days = cube['days']
+    entries = [key for key, values in cube.items() if isinstance(values, np.ndarray)]
+    lo = 0 if start is None else np.searchsorted(cube['day'], days.searchsorted(pd.Timestamp(start).normalize()))
+    hi = len(cube['day']) if end is None else np.searchsorted(cube['day'], days.searchsorted(pd.Timestamp(end).normalize(), side='right'))
+    sliced = dict(cube, **{key: cube[key][lo:hi] for key in entries})
+    if senders is not None:
+        selected = np.zeros(len(cube['senders']), dtype=bool)
+        codes = cube['senders'].get_indexer(pd.Index(senders).astype(str))
+        selected[codes[codes >= 0]] = True
+        keep = selected[sliced['sender']]
+        sliced.update({key: sliced[key][keep] for key in entries})
+    return sliced
+
+
+# Words left out of "Top words": placeholders of omitted media plus common Hebrew/English function words.
+# Words of up to two characters are dropped before this list is consulted.
+TOKEN_STOPWORDS = frozenset({
+    'media', 'omitted', 'image', 'video', 'audio', 'sticker', 'gif', 'document', 'null',
+    'the', 'and', 'for', 'are', 'but', 'not', 'you', 'all', 'any', 'can', 'had', 'her', 'was', 'one',
+    'our', 'out', 'has', 'him', 'his', 'how', 'its', 'she', 'too', 'use', 'who', 'why', 'did', 'yes',
+    'get', 'got', 'let', 'this', 'that', 'with', 'have', 'from', 'they', 'will', 'would', 'there',
+    'their', 'what', 'about', 'which', 'when', 'were', 'been', 'just', 'also', 'into', 'than',
+    'then', 'them', 'these', 'some', 'your', 'only', 'very', 'more', 'here', 'like', 'dont', 'its',
+    'של', 'את', 'על', 'זה', 'עם', 'לא', 'גם', 'אני', 'הוא', 'היא', 'אתה', 'אנחנו', 'הם', 'הן', 'אבל',
+    'כל', 'מה', 'אם', 'או', 'כי', 'יש', 'אין', 'היה', 'היו', 'הייתה', 'להיות', 'זאת', 'זו', 'אלה',
+    'אותו', 'אותה', 'אותם', 'שלי', 'שלך', 'שלו', 'שלה', 'שלנו', 'שלהם', 'עוד', 'כמו', 'רק', 'כבר',
+    'אז', 'מי', 'איך', 'למה', 'איפה', 'מתי', 'כן', 'אתם', 'אתן', 'לי', 'לך', 'לו', 'לה', 'לנו',
+    'להם', 'בין', 'אחרי', 'לפני', 'כדי', 'אצל', 'ממש', 'פה', 'שם', 'עכשיו', 'הזה', 'הזאת', 'האלה',
+    'אחד', 'אחת', 'טוב', 'בסדר', 'אוקיי', 'יותר', 'מאוד', 'אפשר', 'צריך', 'שזה', 'שאני', 'אותי',
+})
+# Anything that is neither a letter, digit, underscore nor whitespace (RE2's \w is ASCII only)
+TOKEN_STRIP_PATTERN = r'[^\p{L}\p{N}_\s]'
+
+
+def build_token_index(df, stopwords=TOKEN_STOPWORDS):
+    """Sparse (day x sender x word) counts of a chat's words, built once per chat.
+
+    Messages are lowercased and stripped of punctuation and emoji, split on
+    whitespace, and words of more than two characters that aren't stopwords
+    are counted. Like the count cube the index is stored sparse and sorted by
+    day, so slice_cube narrows it to the current date range and users:
+        vocabulary  Index of words (codes index into it)
+        senders     Index of sender names
+        days        contiguous daily DatetimeIndex from first to last day
+        day         int32 offset into days, ascending
+        sender      int32 sender code
+        token       int32 word code
+        count       int32 occurrences
+    """
+    senders = pd.Index(df['sender'].astype(str).unique()) if len(df) else pd.Index([], dtype=object)
+    days = pd.date_range(df['day'].iloc[0], df['day'].iloc[-1], freq='D') if len(df) else pd.DatetimeIndex([])
+    empty = np.zeros(0, dtype='int32')
+    if df.empty:
+        return {'vocabulary': pd.Index([], dtype=object), 'senders': senders, 'days': days,
+                'day': empty, 'sender': empty, 'token': empty, 'count': empty}
+
+    # Tokenize with arrow kernels: split, flatten and filter never leave the column.
+    # One contiguous (large_string) array keeps parent indices and the dictionary global.
+    messages = pa.array(df['message']).cast(pa.large_string())
+    if isinstance(messages, pa.ChunkedArray):
+        messages = messages.combine_chunks()
+    cleaned = pc.replace_substring_regex(pc.utf8_lower(messages), TOKEN_STRIP_PATTERN, '')
+    words = pc.utf8_split_whitespace(cleaned)
+    rows = pc.list_parent_indices(words)
+    words = pc.list_flatten(words)
+    keep = pc.and_(pc.greater(pc.utf8_length(words), 2), pc.invert(pc.is_in(words, value_set=pa.array(sorted(stopwords)))))
+    words = words.filter(keep).dictionary_encode()
+    rows = rows.filter(keep).to_numpy()
+
+    message_day = ((df['day'] - days[0]).dt.days).to_numpy(dtype='int64')
+    message_sender = senders.get_indexer(df['sender'].astype(str)).astype('int64')
+    vocabulary = pd.Index(words.dictionary.to_pylist(), dtype=object)
+    # One int64 key per (day, sender, word); np.unique sorts by it, which orders entries by day
+    n_senders, n_words = max(len(senders), 1), max(len(vocabulary), 1)
+    keys = (message_day[rows] * n_senders + message_sender[rows]) * n_words + words.indices.to_numpy().astype('int64')
+    keys, counts = np.unique(keys, return_counts=True)
+    return {
+        'vocabulary': vocabulary,
+        'senders': senders,
+        'days': days,
+        'day': (keys // (n_senders * n_words)).astype('int32'),
+        'sender': (keys // n_words % n_senders).astype('int32'),
+        'token': (keys % n_words).astype('int32'),
+        'count': counts.astype('int32'),
+    }
+
+
+def token_counts(token_index):
+    """Long-form (day, sender, word, count) rows of a token index, the form saved chats keep it in"""
+    return pd.DataFrame({
+        'day': token_index['days'][token_index['day']],
+        'sender': pd.Categorical.from_codes(token_index['sender'], categories=token_index['senders']),
+        'word': pd.Categorical.from_codes(token_index['token'], categories=token_index['vocabulary']),
+        'count': token_index['count'],
+    })
+
+
+def merge_token_counts(*counts):
+    """Add long-form token count tables from token_counts"""
+    merged = pd.concat(counts, ignore_index=True).astype({'sender': str, 'word': str})
+    merged = merged.groupby(['day', 'sender', 'word'], as_index=False)['count'].sum()
+    return merged.astype({'sender': 'category', 'word': 'category', 'count': 'int32'})
+
+
+def token_index_from_counts(counts):
+    """Token index (see build_token_index) from long-form token_counts output"""
+    counts = counts.sort_values('day', kind='stable').astype({'sender': 'category', 'word': 'category'})
+    # Category codes index straight into senders/vocabulary, so no string is looked up
+    senders = pd.Index(counts['sender'].cat.categories.astype(str), dtype=object)
+    vocabulary = pd.Index(counts['word'].cat.categories.astype(str), dtype=object)
+    if counts.empty:
+        days = pd.DatetimeIndex([])
+    else:
+        days = pd.date_range(counts['day'].iloc[0], counts['day'].iloc[-1], freq='D')
+    return {
+        'vocabulary': vocabulary,
+        'senders': senders,
+        'days': days,
+        'day': ((counts['day'] - days[0]).dt.days.to_numpy(dtype='int32') if len(days) else np.zeros(0, 'int32')),
+        'sender': counts['sender'].cat.codes.to_numpy(dtype='int32'),
+        'token': counts['word'].cat.codes.to_numpy(dtype='int32'),
+        'count': counts['count'].to_numpy(dtype='int32'),
+    }
+
+
+def top_words(token_index, n=5):
+    """The n most used words of a (sliced) token index as [(word, count), ...]"""
+    totals = np.bincount(token_index['token'], weights=token_index['count'], minlength=len(token_index['vocabulary']))
+    n = min(n, int((totals > 0).sum()))
+    if n == 0:
+        return []
+    top = np.argpartition(-totals, n - 1)[:n]
+    top = top[np.lexsort((top, -totals[top]))]
+    return [(token_index['vocabulary'][code], int(totals[code])) for code in top]
+
+
+def cube_counts(cube, by):
+    """Message totals of a (sliced) cube grouped by 'sender', 'day', 'hour', 'weekday' or 'day_of_month'.
+
+    'sender' keeps only senders with messages, most active first (like
+    value_counts); 'day' covers every day between the first and last active day.
+    """
+    weights = cube['messages']
+    if by == 'sender':
+        totals = np.bincount(cube['sender'], weights=weights, minlength=len(cube['senders']))
+        counts = pd.Series(totals.astype('int64'), index=cube['senders'], name='count')
+        return counts[counts > 0].sort_values(ascending=False, kind='stable')
+    if by == 'hour':
+        totals = np.bincount(cube['hour'], weights=weights, minlength=24)
+        return pd.Series(totals.astype('int64'), index=pd.RangeIndex(24, name='hour'), name='count')
+
+    per_day = np.bincount(cube['day'], weights=weights, minlength=len(cube['days'])).astype('int64')
+    if by == 'day':
+        if not len(cube['day']):
+            return pd.Series([], dtype='int64', index=pd.DatetimeIndex([], name='day'), name='count')
+        first, last = cube['day'][0], cube['day'][-1]
+        return pd.Series(per_day[first:last + 1], index=cube['days'][first:last + 1].rename('day'), name='count')
+    if by == 'weekday':
+        totals = np.bincount(cube['days'].dayofweek, weights=per_day, minlength=7)
+        return pd.Series(totals.astype('int64'), index=pd.CategoricalIndex(WEEKDAY_NAMES, dtype=WEEKDAY_DTYPE, name='weekday'), name='count')
+    if by == 'day_of_month':
+        totals = np.bincount(cube['days'].day, weights=per_day, minlength=32)[1:]
+        return pd.Series(totals.astype('int64'), index=pd.RangeIndex(1, 32, name='day_of_month'), name='count')
+    raise ValueError(f"Unknown cube grouping: {by}")
+
+
+def cube_active_days(cube):
+    """Number of distinct days with at least one message"""
+    return int(len(np.unique(cube['day'])))
+
+
+DEFAULT_WEEKLY_WINDOW_DAYS = 60
+WEEKLY_CHANGE_CLIP_PERCENT = 500
+
+
+def weekly_activity(cube, window_days=DEFAULT_WEEKLY_WINDOW_DAYS, clip_percent=WEEKLY_CHANGE_CLIP_PERCENT):
+    """Messages per ISO calendar week over the last window_days days of a (sliced) cube.
+
+    Weeks are keyed by (ISO year, week), so weeks of different years never
+    merge, and quiet weeks inside the window appear with zero messages. One
+    row per week, oldest first: messages, first_day/last_day with messages
+    (NaT for quiet weeks), and change_percent against the previous week,
+    0 after a quiet week and clipped to +-clip_percent (NaN for the first week).
+    """
+    daily = cube_counts(cube, 'day')
+    columns = ['messages', 'first_day', 'last_day', 'change_percent']
+    if daily.empty:
+        return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_arrays([[], []], names=['iso_year', 'week']))
+    daily = daily[daily.index >= daily.index[-1] - pd.Timedelta(days=window_days)]
+
+    iso = daily.index.isocalendar()
+    active_days = daily.index.where(daily.to_numpy() > 0)
+    weekly = pd.DataFrame({
+        'iso_year': iso['year'].to_numpy(),
+        'week': iso['week'].to_numpy(),
+        'messages': daily.to_numpy(),
+        'first_day': active_days,
+        'last_day': active_days,
+    }).groupby(['iso_year', 'week']).agg({'messages': 'sum', 'first_day': 'min', 'last_day': 'max'})
+
+    previous = weekly['messages'].shift(1)
+    change = ((weekly['messages'] - previous) / previous * 100).where(previous != 0, 0)
+    weekly['change_percent'] = change.clip(-clip_percent, clip_percent).where(previous.notna())
+    return weekly[columns]
+
+
+# Longest span in days drawn at each time granularity; longer spans use monthly points
+GRANULARITY_MAX_DAYS = {'day': 180, 'week': 3 * 365}
+# Points sent to the browser per time series, and the point count from which charts switch to WebGL
+MAX_CHART_POINTS = 2000
+WEBGL_POINT_THRESHOLD = 1000
+
+
+def choose_granularity(start, end):
+    """'day', 'week' or 'month' - the finest granularity that keeps start..end readable"""
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days + 1
+    for granularity, max_days in GRANULARITY_MAX_DAYS.items():
+        if days <= max_days:
+            return granularity
+    return 'month'
+
+
+def resample_counts(daily, granularity):
+    """Sum a per-day count series into weeks (labelled by their Monday) or calendar months"""
+    if granularity == 'day':
+        return daily
+    if granularity == 'week':
+        return daily.resample('W-MON', label='left', closed='left').sum()
+    if granularity == 'month':
+        return daily.resample('MS').sum()
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def minmax_downsample(series, max_points=MAX_CHART_POINTS):
+    """At most max_points points of series: the minimum and maximum of equal-width buckets, in order.
+
+    Unlike averaging, every peak and dip of the full series stays in the chart.
+    """
+    if len(series) <= max_points:
+        return series
+    bucket = -(-len(series) // (max_points // 2))
+    n_buckets = -(-len(series) // bucket)
+    values = np.full(n_buckets * bucket, np.nan)
+    values[:len(series)] = series.to_numpy(dtype='float64')
+    values = values.reshape(n_buckets, bucket)
+    offsets = np.arange(n_buckets) * bucket
+    keep = np.union1d(offsets + np.nanargmin(values, axis=1), offsets + np.nanargmax(values, axis=1))
+    return series.iloc[keep]
+
+
+def filter_date_range(df, start=None, end=None):
+    """Messages with start <= datetime <= end (either bound may be None).
+
+    Message frames are sorted by datetime, so the range is found by binary search
+    and returned as a positional slice, a view that copies no rows.
+    """
+    if start is None and end is None:
+        return df
+    timestamps = df['datetime'].to_numpy()
+    lo = 0 if start is None else timestamps.searchsorted(pd.Timestamp(start).to_datetime64(), side='left')
+    hi = len(timestamps) if end is None else timestamps.searchsorted(pd.Timestamp(end).to_datetime64(), side='right')
+    return df.iloc[lo:hi]
+
+
+def sender_totals(df, columns=('emoji_count', 'is_greeting', 'is_media')):
+    """Per-sender sums of message feature columns, in a single grouped reduction"""
+    return df.groupby('sender', observed=True, sort=False)[list(columns)].sum()
+
+
+def observed_counts(series):
+    """value_counts without the zero rows categorical columns report for unobserved values"""
+    counts = series.value_counts()
+    return counts[counts > 0]
+
+
+
+def detect_line_format(lines, sample_size=FORMAT_SAMPLE_LINES):
+    """Return the name of the format matching most sender lines in the sample, or None"""
+    sample = []
+    for line in lines:
+        line = clean_line(line)
+        if line:
+            sample.append(line)
+            if len(sample) >= sample_size:
+                break
+
+    best_name, best_hits = None, 0
+    for name, pattern in LINE_FORMATS.items():
+        hits = 0
+        for line in sample:
+            match = pattern.match(line)
+            if match and match.group(3):
+                hits += 1
+        if hits > best_hits:
+            best_name, best_hits = name, hits
+    return best_name
+
+
+# Date separator used by each line format
+DATE_SEPARATORS = {'standard': '/', 'bracket': '/', 'no_comma': '/', 'iso': '-', 'dotted': '.'}
+
+
+def _date_order_cost(dates):
+    """(backward steps, total absolute gap) of a chronologically ordered date sequence.
+
+    The right day/month order keeps a chat moving forward in small steps.
+    """
+    steps = dates.diff().dropna()
+    return int((steps < pd.Timedelta(0)).sum()), steps.abs().sum()
+
+
+def detect_timestamp_format(date_strs, time_strs, line_format):
+    """Choose one date/time format for the whole file from the raw string columns.
+
+    Day-first vs month-first is settled by any field above 12; if every date is
+    ambiguous, the order whose dates run forward in the smallest steps wins,
+    falling back to month-first for slash dates and day-first for dotted ones. Year
+    width and 12h/24h clock are also decided once from all values.
+
+    Returns a dict with date_order ('DMY', 'MDY' or 'YMD'), year_digits, clock,
+    seconds (True, False or None when mixed) and the strptime format.
+    """
+    separator = DATE_SEPARATORS[line_format]
+    # Chats have far fewer distinct dates/times than lines, in first-seen (chronological) order
+    unique_dates = pd.Series(pd.Series(date_strs).unique())
+    unique_times = pd.Series(pd.Series(time_strs).unique())
+
+    parts = unique_dates.str.split(separator, n=2, expand=True)
+    if line_format == 'iso':
+        date_order = 'YMD'
+        year_digits = 4
+    else:
+        year_digits = 2 if (parts[2].str.len() <= 2).all() else 4
+        first = parts[0].astype(int)
+        second = parts[1].astype(int)
+        if (first > 12).any():
+            date_order = 'DMY'
+        elif (second > 12).any():
+            date_order = 'MDY'
+        else:
+            year = '%y' if year_digits == 2 else '%Y'
+            costs = {}
+            for order in ('MDY', 'DMY'):
+                fmt = separator.join(['%m', '%d', year] if order == 'MDY' else ['%d', '%m', year])
+                costs[order] = _date_order_cost(pd.to_datetime(unique_dates, format=fmt, errors='coerce'))
+            if costs['MDY'] == costs['DMY']:
+                date_order = 'MDY' if separator == '/' else 'DMY'
+            else:
+                date_order = min(costs, key=costs.get)
+
+    year = '%y' if year_digits == 2 else '%Y'
+    date_fields = {'YMD': ['%Y', '%m', '%d'], 'MDY': ['%m', '%d', year], 'DMY': ['%d', '%m', year]}[date_order]
+
+    clock = '12h' if unique_times.str.contains('M', regex=False).any() else '24h'
+    colons = unique_times.str.count(':')
+    if (colons == 2).all():
+        seconds = True
+    elif (colons == 1).all():
+        seconds = False
+    else:
+        seconds = None
+
+    time_format = ('%I' if clock == '12h' else '%H') + (':%M:%S' if seconds else ':%M') + (' %p' if clock == '12h' else '')
+    return {
+        'date_order': date_order,
+        'year_digits': year_digits,
+        'clock': clock,
+        'seconds': seconds,
+        'date_format': separator.join(date_fields),
+        'time_format': time_format,
+        'format': separator.join(date_fields) + ' ' + time_format,
+    }
+
+
+def parse_timestamps(date_strs, time_strs, timestamp_format):
+    """Vectorized conversion of raw date/time columns; unparseable rows become NaT.
+
+    Dates and times are converted once per distinct value and broadcast back
+    through the factorized codes, so the cost tracks distinct days, not lines.
+    """
+    date_codes, date_values = pd.factorize(pd.Series(date_strs))
+    time_codes, time_values = pd.factorize(pd.Series(time_strs))
+
+    dates = pd.to_datetime(pd.Series(date_values), format=timestamp_format['date_format'], errors='coerce')
+
+    times = pd.Series(time_values)
+    if timestamp_format['clock'] == '12h':
+        # Exports use a plain or narrow no-break space (or none) before AM/PM
+        times = times.str.replace(r'\s*([AP]M)', r' \1', regex=True)
+    time_format = timestamp_format['time_format']
+    clock_times = pd.to_datetime(times, format=time_format, errors='coerce')
+    if timestamp_format['seconds'] is None:
+        # Mixed precision: retry the misses with the other seconds variant
+        other = time_format.replace(':%M:%S', ':%M') if ':%S' in time_format else time_format.replace(':%M', ':%M:%S')
+        missing = clock_times.isna()
+        clock_times[missing] = pd.to_datetime(times[missing], format=other, errors='coerce')
+    offsets = clock_times - pd.Timestamp('1900-01-01')
+
+    return pd.Series(dates.to_numpy()[date_codes] + offsets.to_numpy()[time_codes], name='datetime')
+
+
+# Messages per chunk emitted by iter_raw_chunks
+DEFAULT_CHUNK_MESSAGES = 100_000
+
+RAW_COLUMNS = ['date_str', 'time_str', 'sender', 'message']
+
+
+def iter_raw_chunks(lines, line_format, chunk_size=DEFAULT_CHUNK_MESSAGES):
+    """Run the line state machine over an iterable of lines, yielding raw chunks.
+
+    Each chunk is a DataFrame of up to chunk_size messages with the raw date and
+    time strings still unconverted. Lines that don't start a new message are
+    appended to the previous message, so multi-line messages are kept whole;
+    system messages (no sender) are skipped. Repeated date, time and sender
+    strings are interned so a chunk only pays for the message text.
+    """
+    match_line = LINE_FORMATS[line_format].match
+    intern = {}.setdefault
+    date_strs, time_strs, senders, messages = [], [], [], []
+    # Continuation lines of the current message, joined when the next one starts
+    current = None
+
+    for line in lines:
+        line = clean_line(line)
+        if not line:
+            continue
+
+        match = match_line(line)
+        if match is None:
+            if current is not None:
+                current.append(line)
+            continue
+
+        if current is not None and len(current) > 1:
+            messages[-1] = '\n'.join(current)
+        current = None
+
+        date_str, time_str, sender, message = match.groups()
+        if sender is None:
+            continue
+
+        # Only flush between messages, once the previous one can no longer grow
+        if len(messages) >= chunk_size:
+            yield pd.DataFrame(dict(zip(RAW_COLUMNS, (date_strs, time_strs, senders, messages))))
+            date_strs, time_strs, senders, messages = [], [], [], []
+
+        message = message.strip()
+        date_strs.append(intern(date_str, date_str))
+        time_strs.append(intern(time_str, time_str))
+        sender = sender.strip()
+        senders.append(intern(sender, sender))
+        messages.append(message)
+        current = [message]
+
+    if current is not None and len(current) > 1:
+        messages[-1] = '\n'.join(current)
+
+    if messages:
+        yield pd.DataFrame(dict(zip(RAW_COLUMNS, (date_strs, time_strs, senders, messages))))
+
+
+def assemble_messages(raw_chunks, line_format, timestamp_format=None):
+    """Concatenate raw chunks and convert their timestamps with one per-file format.
+
+    Timestamps are converted in bulk with a single format chosen for the whole
+    file (see detect_timestamp_format) unless a known timestamp_format is
+    passed in; the decision is stored in df.attrs['timestamp_format']. The result uses the compact message schema,
+    with frame sizes before and after compaction (and of the feature columns) in df.attrs['memory_bytes'].
+    """
+    raw_chunks = list(raw_chunks)
+    if not raw_chunks:
+        return empty_messages()
+    raw = pd.concat(raw_chunks, ignore_index=True) if len(raw_chunks) > 1 else raw_chunks[0]
+    del raw_chunks
+
+    if timestamp_format is None:
+        timestamp_format = detect_timestamp_format(raw['date_str'], raw['time_str'], line_format)
+    df = pd.DataFrame({
+        'datetime': parse_timestamps(raw['date_str'], raw['time_str'], timestamp_format),
+        'sender': raw['sender'],
+        'message': raw['message'],
+    })
+    del raw
+    df = df.dropna(subset=['datetime']).reset_index(drop=True)
+    # Exports are chronological but edited or merged files may not be; keep file order among equal times
+    if not df['datetime'].is_monotonic_increasing:
+        df = df.sort_values('datetime', kind='stable', ignore_index=True)
+    parsed_bytes = int(df.memory_usage(deep=True).sum())
+    df = apply_message_schema(df)
+    df.attrs['timestamp_format'] = dict(timestamp_format, line_format=line_format)
+    feature_bytes = int(df[FEATURE_COLUMNS].memory_usage().sum())
+    df.attrs['memory_bytes'] = {
+        'parsed': parsed_bytes,
+        'compact': int(df.memory_usage(deep=True).sum()) - feature_bytes,
+        'features': feature_bytes,
+    }
+    return df
+
+
+def parse_whatsapp_content(content, line_format=None):
+    """Parse WhatsApp chat content into a datetime/sender/message DataFrame.
+
+    The export format is detected once from the leading lines (unless given),
+    then every line is matched against that single precompiled pattern.
+    """
+    lines = content.split('\n')
+    if line_format is None:
+        line_format = detect_line_format(lines)
+    if line_format is None:
+        return empty_messages()
+    return assemble_messages(iter_raw_chunks(lines, line_format), line_format)
+
+
+# Bytes looked at by sniff_encoding
+ENCODING_SAMPLE_BYTES = 64
+
+
+def sniff_encoding(head):
+    """Encoding of export bytes from their first bytes.
+
+    A BOM decides it; without one, NUL bytes in every other position mean
+    UTF-16 (ASCII digits and separators start every line). Anything else is
+    UTF-8, with an optional BOM.
+    """
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    if not head.startswith(codecs.BOM_UTF8) and len(head) >= 2:
+        even, odd = head[0::2], head[1::2]
+        if odd.count(0) > len(odd) // 2 and not even.count(0):
+            return 'utf-16-le'
+        if even.count(0) > len(even) // 2 and not odd.count(0):
+            return 'utf-16-be'
+    return 'utf-8-sig'
+
+
+def decode_export(data):
+    """Export bytes as text, in their sniffed encoding"""
+    return data.decode(sniff_encoding(data[:ENCODING_SAMPLE_BYTES]), errors='replace')
+
+
+def parse_whatsapp_stream(stream, encoding=None, chunk_size=DEFAULT_CHUNK_MESSAGES, timestamp_format=None):
+    """Parse a binary stream (an upload or a zip member) without holding the whole text.
+
+    Bytes go through an incremental decoder line by line and are turned into
+    raw chunks of chunk_size messages, so peak memory stays close to the final
+    frame instead of bytes + decoded text + line list + frame. Unless given,
+    the encoding is sniffed from the first bytes (see sniff_encoding). A known
+    timestamp_format (from df.attrs of an earlier parse of the same chat) fixes
+    both the line format and the timestamp format instead of detecting them.
+    """
+    if encoding is None:
+        if not hasattr(stream, 'peek'):
+            stream = io.BufferedReader(stream)
+        encoding = sniff_encoding(stream.peek(ENCODING_SAMPLE_BYTES)[:ENCODING_SAMPLE_BYTES])
+    text = io.TextIOWrapper(stream, encoding=encoding, errors='replace')
+    head = list(islice(text, FORMAT_SAMPLE_LINES))
+    line_format = timestamp_format['line_format'] if timestamp_format else detect_line_format(head)
+    if line_format is None:
+        return empty_messages()
+    raw_chunks = iter_raw_chunks(chain(head, text), line_format, chunk_size)
+    return assemble_messages(raw_chunks, line_format, timestamp_format)
+
+
+def _message_at(data, pos, match_line):
+    """(offset, match) of the first message line at or after the line starting at pos"""
+    size = len(data)
+    while pos < size:
+        line_end = data.find(b'\n', pos)
+        if line_end == -1:
+            line_end = size
+        line = clean_line(data[pos:line_end].decode('utf-8', errors='replace'))
+        match = match_line(line) if line else None
+        if match and match.group(3) is not None:
+            return pos, match
+        pos = line_end + 1
+    return size, None
+
+
+def find_tail_offset(data, timestamp_format, cutoff):
+    """Byte offset of the first message at or after cutoff in chronological UTF-8 export bytes.
+
+    Binary search over byte positions, so only O(log size) lines are parsed.
+    """
+    match_line = LINE_FORMATS[timestamp_format['line_format']].match
+    cutoff = pd.Timestamp(cutoff)
+
+    def message_at(pos):
+        # Resynchronise on the next line start, then skip continuation/system lines
+        if pos > 0:
+            newline = data.find(b'\n', pos - 1)
+            pos = len(data) if newline == -1 else newline + 1
+        return _message_at(data, pos, match_line)
+
+    lo, hi = 0, len(data)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        offset, match = message_at(mid)
+        if match is None or parse_timestamps([match.group(1)], [match.group(2)], timestamp_format)[0] >= cutoff:
+            hi = mid
+        else:
+            lo = mid + 1
+    return message_at(lo)[0]
+
+
+# Inputs at least this large are parsed in parallel by parse_whatsapp_bytes
+PARALLEL_THRESHOLD_BYTES = 32 * 1024 * 1024
+# Bytes decoded from the head of the input for format detection
+FORMAT_SAMPLE_BYTES = 64 * 1024
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    """Process pool reused across calls, forked from a server with this module preloaded"""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context('spawn')
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return pool
+
+
+def _drop_pool(workers, pool):
+    """Forget a broken pool so the next _get_pool starts a fresh one"""
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def split_shards(data, line_format, n_shards):
+    """Split UTF-8 export bytes into up to n_shards (start, end) ranges.
+
+    Every range after the first starts on a line that begins a new message (or
+    system message), so no multi-line message is cut between shards.
+    """
+    match_line = LINE_FORMATS[line_format].match
+    size = len(data)
+    bounds = [0]
+    for k in range(1, n_shards):
+        pos = max(size * k // n_shards, bounds[-1])
+        while True:
+            newline = data.find(b'\n', pos)
+            if newline == -1:
+                pos = size
+                break
+            pos = newline + 1
+            line_end = data.find(b'\n', pos)
+            line = clean_line(data[pos:line_end if line_end != -1 else size].decode('utf-8', errors='replace'))
+            if line and match_line(line):
+                break
+        if bounds[-1] < pos < size:
+            bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _parse_shard(shard, line_format, encoding):
+    """Worker: raw chunks for one shard, decoded exactly like parse_whatsapp_stream"""
+    text = io.TextIOWrapper(io.BytesIO(shard), encoding=encoding, errors='replace')
+    return list(iter_raw_chunks(text, line_format))
+
+
+def parse_whatsapp_bytes(data, encoding=None, workers=None, parallel_threshold=PARALLEL_THRESHOLD_BYTES):
+    """Parse raw export bytes, sharding across a process pool for large inputs.
+
+    Below parallel_threshold (or with a single worker, or a non UTF-8 encoding,
+    sniffed unless given) this is parse_whatsapp_stream. Otherwise the bytes are split on message
+    boundaries, shards are parsed by `workers` processes (default: all cores)
+    and their raw chunks are merged in order before the timestamp conversion,
+    so the result is identical to the serial path. If a worker dies, the
+    pool is replaced on the next call and this input is parsed serially.
+    """
+    workers = workers or os.cpu_count() or 1
+    encoding = encoding or sniff_encoding(data[:ENCODING_SAMPLE_BYTES])
+    utf8 = encoding.lower().replace('_', '-') in ('utf-8', 'utf-8-sig', 'utf8')
+    if workers == 1 or len(data) < parallel_threshold or not utf8:
+        return parse_whatsapp_stream(io.BytesIO(data), encoding=encoding)
+
+    head = data[:FORMAT_SAMPLE_BYTES].decode(encoding, errors='replace').split('\n')[:FORMAT_SAMPLE_LINES]
+    line_format = detect_line_format(head)
+    if line_format is None:
+        return empty_messages()
+
+    shards = split_shards(data, line_format, workers)
+    pool = _get_pool(workers)
+    try:
+        futures = [
+            # Only the first shard can carry a BOM
+            pool.submit(_parse_shard, data[start:end], line_format, encoding if i == 0 else 'utf-8')
+            for i, (start, end) in enumerate(shards)
+        ]
+        raw_chunks = []
+        for future in futures:
+            raw_chunks.extend(future.result())
+    except BrokenProcessPool:
+        # A worker died (out of memory on a large shard, say): replace the pool next time, parse this one serially
+        _drop_pool(workers, pool)
+        return parse_whatsapp_stream(io.BytesIO(data), encoding=encoding)
+    return assemble_messages(raw_chunks, line_format)
+
+
+# Names WhatsApp gives the chat text of an export: _chat.txt (iOS), "WhatsApp Chat with X.txt" (Android)
+CHAT_MEMBER_PATTERN = re.compile(r'(?:^|/)(?:_chat|[^/]*whatsapp[^/]*)\.txt$', re.IGNORECASE)
+
+
+def find_chat_member(zip_file):
+    """ZipInfo of the chat text inside an export, or None if there is no .txt member.
+
+    Exports can bundle other .txt files as attached documents, so candidates
+    are tried by WhatsApp's own naming first, then largest first, and the
+    first whose head parses as a chat wins. Failing that, the best-named one
+    is returned so the caller can still show what it contains.
+    """
+    texts = [info for info in zip_file.infolist() if info.filename.lower().endswith('.txt') and not info.is_dir()]
+    texts.sort(key=lambda info: (not CHAT_MEMBER_PATTERN.search(info.filename), -info.file_size))
+    for info in texts:
+        with zip_file.open(info) as member:
+            head = member.read(FORMAT_SAMPLE_BYTES)
+        if detect_line_format(decode_export(head).split('\n')[:FORMAT_SAMPLE_LINES]) is not None:
+            return info
+    return texts[0] if texts else None
+
+
+def open_txt_from_zip(zip_source):
+    """Open the chat .txt inside a zip export as a binary stream.
+
+    zip_source is a path or a seekable binary file object; the member is
+    picked by find_chat_member and decompressed lazily as the stream is read.
+    Closing the stream also closes the archive. Returns (stream, uncompressed
+    size), or (None, 0) if the archive has no .txt member.
+    """
+    with zipfile.ZipFile(zip_source, 'r') as zip_file:
+        info = find_chat_member(zip_file)
+        if info is None:
+            return None, 0
+        # The open member holds the archive file until it is closed itself
+        return zip_file.open(info), info.file_size
+
+
+# Media kind by the prefix WhatsApp names attachments with (Android IMG-20240115-WA0003.jpg,
+# iOS 00000012-PHOTO-2024-01-15-10-22-33.jpg), then by extension
+MEDIA_NAME_KINDS = {
+    'IMG': 'image', 'PHOTO': 'image', 'VID': 'video', 'VIDEO': 'video', 'AUD': 'audio', 'PTT': 'audio',
+    'AUDIO': 'audio', 'STK': 'sticker', 'STICKER': 'sticker', 'GIF': 'gif', 'DOC': 'document', 'DOCUMENT': 'document',
+}
+MEDIA_EXTENSION_KINDS = {
+    'jpg': 'image', 'jpeg': 'image', 'png': 'image', 'heic': 'image', 'mp4': 'video', 'mov': 'video',
+    '3gp': 'video', 'opus': 'audio', 'ogg': 'audio', 'm4a': 'audio', 'mp3': 'audio', 'aac': 'audio',
+    'webp': 'sticker', 'gif': 'gif', 'pdf': 'document', 'txt': 'document', 'doc': 'document',
+    'docx': 'document', 'xlsx': 'document', 'pptx': 'document', 'vcf': 'contact',
+}
+MEDIA_KIND_DTYPE = pd.CategoricalDtype(
+    ['image', 'video', 'audio', 'sticker', 'gif', 'document', 'contact', 'other']
+)
+MEDIA_NAME_PATTERN = re.compile(
+    r'^(?:(?P<android>[A-Z]{3})-(?P<date>\d{8})-WA\d+'
+    r'|\d+-(?P<ios>[A-Z]+)-(?P<datetime>\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}))'
+)
+MANIFEST_COLUMNS = ['name', 'kind', 'bytes', 'compressed_bytes', 'timestamp']
+
+
+def read_media_manifest(zip_source):
+    """One row per attachment of a zip export, read from the central directory alone.
+
+    Nothing is decompressed: name (without folders), kind, bytes and
+    compressed_bytes come from the directory entries, and timestamp from the
+    name WhatsApp gave the file (the date only on Android, NaT if unnamed).
+    The chat text itself is left out.
+    """
+    with zipfile.ZipFile(zip_source, 'r') as zip_file:
+        chat = find_chat_member(zip_file)
+        members = [
+            info for info in zip_file.infolist()
+            if not info.is_dir() and (chat is None or info.filename != chat.filename)
+        ]
+    rows = []
+    for info in members:
+        name = info.filename.rsplit('/', 1)[-1]
+        match = MEDIA_NAME_PATTERN.match(name)
+        prefix = match and (match['android'] or match['ios'])
+        extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+        kind = MEDIA_NAME_KINDS.get(prefix) or MEDIA_EXTENSION_KINDS.get(extension, 'other')
+        timestamp = None
+        if match and match['date']:
+            timestamp = pd.to_datetime(match['date'], format='%Y%m%d', errors='coerce')
+        elif match and match['datetime']:
+            timestamp = pd.to_datetime(match['datetime'], format='%Y-%m-%d-%H-%M-%S', errors='coerce')
+        rows.append((name, kind, info.file_size, info.compress_size, timestamp))
+    manifest = pd.DataFrame(rows, columns=MANIFEST_COLUMNS)
+    return manifest.astype({
+        'kind': MEDIA_KIND_DTYPE, 'bytes': 'int64', 'compressed_bytes': 'int64', 'timestamp': 'datetime64[s]'
+    })
+
+
+# The file name in a message that carries an attachment: "<attached: NAME>" (iOS), "NAME (file attached)" (Android)
+ATTACHMENT_PATTERN = r'<attached: ([^<>]+)>|^[\s\u200e]*(\S+\.\w+) \(file attached\)'
+
+
+def media_by_sender(df, manifest):
+    """Attachment files and bytes per sender, matching media messages to manifest names.
+
+    Only messages flagged is_media are searched, and only files present in
+    the archive count: exports made without media have no manifest rows.
+    Returns a frame indexed by sender with files and bytes, largest first.
+    """
+    media = df.loc[df['is_media'], ['sender', 'message']]
+    names = media['message'].str.extract(ATTACHMENT_PATTERN)
+    attached = pd.DataFrame({
+        'sender': media['sender'].astype(str),
+        'name': names[0].fillna(names[1]).astype(object),
+    }).dropna(subset=['name'])
+    matched = attached.merge(manifest[['name', 'bytes']].drop_duplicates('name'), on='name')
+    totals = matched.groupby('sender').agg(files=('name', 'size'), bytes=('bytes', 'sum'))
+    return totals.sort_values('bytes', ascending=False, kind='stable')
@@ -1,15 +1,71 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from collections import Counter
-import re
-import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import cProfile
 import io
-from datetime import datetime, timedelta
-import emoji
+import hashlib
+import marshal
+import multiprocessing
+import os
+import pstats
+import threading
+import time
+from datetime import timedelta
 import numpy as np
 
+from whatsapp_analyzer_analysis import (
+    chat_summary,
+    compare_chats,
+    create_fun_facts,
+    create_leaderboards,
+    create_time_breakdowns,
+    create_user_stats,
+    get_interesting_facts,
+)
+from whatsapp_analyzer_core import (
+    DEFAULT_WEEKLY_WINDOW_DAYS,
+    ENCODING_SAMPLE_BYTES,
+    PARALLEL_THRESHOLD_BYTES,
+    WEBGL_POINT_THRESHOLD,
+    build_count_cube,
+    build_token_index,
+    choose_granularity,
+    cube_active_days,
+    cube_counts,
+    cube_from_counts,
+    decode_export,
+    filter_date_range,
+    media_by_sender,
+    minmax_downsample,
+    open_txt_from_zip,
+    parse_whatsapp_bytes,
+    parse_whatsapp_stream,
+    read_media_manifest,
+    resample_counts,
+    slice_cube,
+    sniff_encoding,
+    token_index_from_counts,
+    top_words,
+    weekly_activity,
+)
+from whatsapp_analyzer_search import DEFAULT_PAGE_SIZE, index_messages, open_search_index, search_messages
+from whatsapp_analyzer_store import (
+    IDENTITY_SAMPLE_BYTES,
+    export_identity,
+    import_exports,
+    list_stored_chats,
+    load_stored_chat,
+    load_stored_counts,
+    load_stored_token_counts,
+    match_stored_chat,
+    open_stored_search,
+    save_stored_chat,
+    update_stored_chat,
+)
+
 # Page configuration
 st.set_page_config(
     page_title="WhatsApp Analyzer Pro",
@@ -80,7 +136,7 @@ is_hebrew = language == "עברית"
 # Labels
 if is_hebrew:
     page_title = "📱 מנתח WhatsApp Pro"
-    upload_label = "העלה קובץ WhatsApp (.txt או .zip)"
+    upload_label = "העלה קובץ WhatsApp אחד או יותר (.txt או .zip)"
     processing_label = "מעבד קובץ..."
     no_file_label = "אנא העלה קובץ WhatsApp"
     total_messages = "סה״כ הודעות"
@@ -117,15 +173,25 @@ if is_hebrew:
     the_ghost = "הרוח"
     morning_champion = "אלוף הבוקר טוב"
     sticker_addict = "מכור הסטיקרים"
-    explanation_top_chatter = "מי שלח הכי הרבה הודעות בקבוצה"
-    explanation_digger = "מי שלח את ההודעה הכי ארוכה (הכי הרבה תווים)"
-    explanation_emoji_king = "מי השתמש הכי הרבה באימוג'י"
-    explanation_ghost = "מי שלח הכי פחות הודעות (הכי שקט)"
-    explanation_morning_champion = "מי אמר הכי הרבה 'בוקר טוב' או 'good morning'"
-    explanation_sticker_addict = "מי שלח הכי הרבה מדיה (תמונות, וידאו, סטיקרים)"
+    saved_chats = "צ'אטים שמורים"
+    open_saved_chat = "פתח צ'אט שמור"
+    uploaded_file_option = "— הקובץ שהועלה —"
+    compare_uploads_option = "— השוואת הקבצים שהועלו —"
+    save_chat = "💾 שמור צ'אט מקומית"
+    search_messages_title = "חיפוש הודעות"
+    search_placeholder = 'מילים, "ביטוי מדויק" או תחילית*'
+    results_page = "עמוד"
+    diagnostics = "🩺 אבחון ביצועים"
+    profile_rerun = "פרופיילינג של הריצה (cProfile)"
+    stage_times = "זמני שלבים"
+    compare_title = "השוואת צ'אטים"
+    compare_activity = "פעילות לאורך זמן"
+    chats_leaderboard = "דירוג הצ'אטים"
+    shared_members = "חברים משותפים"
+    members_across_chats = "חברים בכמה צ'אטים"
 else:
     page_title = "📱 WhatsApp Analyzer Pro"
-    upload_label = "Upload WhatsApp file (.txt or .zip)"
+    upload_label = "Upload one or more WhatsApp files (.txt or .zip)"
     processing_label = "Processing file..."
     no_file_label = "Please upload a WhatsApp file"
     total_messages = "Total Messages"
@@ -162,278 +228,723 @@ else:
     the_ghost = "The Ghost"
     morning_champion = "Good Morning Champion"
     sticker_addict = "Sticker Addict"
-    explanation_top_chatter = "Who sent the most messages in the group"
-    explanation_digger = "Who sent the longest message (most characters)"
-    explanation_emoji_king = "Who used the most emojis"
-    explanation_ghost = "Who sent the least messages (quietest)"
-    explanation_morning_champion = "Who said 'good morning' the most"
-    explanation_sticker_addict = "Who sent the most media (photos, videos, stickers)"
+    saved_chats = "Saved Chats"
+    open_saved_chat = "Open saved chat"
+    uploaded_file_option = "— Uploaded file —"
+    compare_uploads_option = "— Compare uploaded files —"
+    save_chat = "💾 Save chat locally"
+    search_messages_title = "Search Messages"
+    search_placeholder = 'words, "exact phrase" or prefix*'
+    results_page = "Page"
+    diagnostics = "🩺 Diagnostics"
+    profile_rerun = "Profile this rerun (cProfile)"
+    stage_times = "Stage timings"
+    compare_title = "Chat Comparison"
+    compare_activity = "Activity Over Time"
+    chats_leaderboard = "Chats Leaderboard"
+    shared_members = "Shared Members"
+    members_across_chats = "Members in Several Chats"
+
+# Diagnostics: wall time per stage of this rerun, optionally with a cProfile of the whole rerun
+rerun_started = time.perf_counter()
+stage_timings = []
+show_diagnostics = st.sidebar.checkbox(diagnostics, key='show_diagnostics')
+profiler = None
+if show_diagnostics and st.sidebar.checkbox(profile_rerun, key='profile_rerun'):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one profiler can run at a time, e.g. when another session is profiling
+        profiler = None
+        st.sidebar.warning("Another rerun is being profiled")
+
+@contextmanager
+def timed_stage(stage):
+    """Time the enclosed block as one row of the diagnostics panel; the yielded dict takes extra columns (rows, cache)"""
+    row = {'stage': stage}
+    stage_timings.append(row)
+    started = time.perf_counter()
+    try:
+        yield row
+    finally:
+        row['seconds'] = time.perf_counter() - started
+
+class StopPage(Exception):
+    """Ends this rerun's page early like st.stop(), while still letting the diagnostics panel draw"""
 
 # Main title
 st.markdown(f'<div class="main-header"><h1>{page_title}</h1></div>', unsafe_allow_html=True)
 
-def extract_txt_from_zip(zip_bytes):
-    """Extract txt file from zip with error handling"""
+def open_chat_stream(file_bytes, file_name):
+    """Open the uploaded chat text as a binary stream, unpacking zips with error handling.
+
+    Returns (stream, size of the chat text), or (None, 0) if it can't be read.
+    """
+    if not file_name.endswith('.zip'):
+        return io.BytesIO(file_bytes), len(file_bytes)
     try:
-        with zipfile.ZipFile(io.BytesIO(zip_bytes), 'r') as zip_file:
-            for file_name in zip_file.namelist():
-                if file_name.endswith('.txt'):
-                    return zip_file.read(file_name).decode('utf-8')
-        return None
+        return open_txt_from_zip(io.BytesIO(file_bytes))
     except Exception as e:
         st.error(f"Error reading zip file: {e}")
-        return None
+        return None, 0
 
-def parse_whatsapp_content(content):
-    """Parse WhatsApp chat content with multiple format support"""
-    messages = []
-    
-    # Multiple regex patterns for different WhatsApp formats
-    patterns = [
-        # Standard format: 29/07/2025, 20:30 - User: Message
-        r'(\d{1,2}/\d{1,2}/\d{2,4}),?\s+(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AP]M)?)\s*-\s*([^:]+):\s*(.+)',
-        # Bracket format: [29/07/2025, 20:30] User: Message
-        r'\[(\d{1,2}/\d{1,2}/\d{2,4}),?\s+(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AP]M)?)\]\s*([^:]+):\s*(.+)',
-        # No comma format: 29/07/2025 20:30 - User: Message
-        r'(\d{1,2}/\d{1,2}/\d{2,4})\s+(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AP]M)?)\s*-\s*([^:]+):\s*(.+)',
-        # ISO format: 2025-07-29 20:30 - User: Message
-        r'(\d{4}-\d{1,2}-\d{1,2})\s+(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AP]M)?)\s*-\s*([^:]+):\s*(.+)',
-        # Alternative format: 29.07.2025 20:30 - User: Message
-        r'(\d{1,2}\.\d{1,2}\.\d{2,4})\s+(\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AP]M)?)\s*-\s*([^:]+):\s*(.+)'
-    ]
-    
-    for line in content.split('\n'):
-        line = line.strip()
-        if not line:
-            continue
-            
-        for pattern in patterns:
-            match = re.match(pattern, line)
-            if match:
-                date_str, time_str, sender, message = match.groups()
-                
-                # Parse date
-                try:
-                    if '/' in date_str:
-                        # Check if it's MM/DD/YY format (like 11/20/16)
-                        parts = date_str.split('/')
-                        if len(parts) == 3:
-                            if len(parts[2]) == 2:  # YY format
-                                # Convert YY to YYYY
-                                parts[2] = '20' + parts[2]
-                                date_str = '/'.join(parts)
-                            
-                            # Try MM/DD/YYYY first (American format)
-                            try:
-                                date_obj = datetime.strptime(date_str, '%m/%d/%Y')
-                            except:
-                                # Try DD/MM/YYYY (European format)
-                                date_obj = datetime.strptime(date_str, '%d/%m/%Y')
-                    elif '-' in date_str:
-                        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                    elif '.' in date_str:
-                        date_obj = datetime.strptime(date_str, '%d.%m.%Y')
-                    else:
-                        continue
-                except:
-                    continue
-                
-                # Parse time
-                try:
-                    if 'AM' in time_str or 'PM' in time_str:
-                        time_obj = datetime.strptime(time_str, '%I:%M:%S %p').time()
-                    else:
-                        time_obj = datetime.strptime(time_str, '%H:%M').time()
-                except:
-                    try:
-                        time_obj = datetime.strptime(time_str, '%H:%M:%S').time()
-                    except:
-                        continue
-                
-                # Combine date and time
-                datetime_obj = datetime.combine(date_obj.date(), time_obj)
-                
-                messages.append({
-                    'datetime': datetime_obj,
-                    'sender': sender.strip(),
-                    'message': message.strip()
-                })
-                break
-    
-    # Debug: Show first few lines if no messages found
-    if not messages:
-        st.warning("לא נמצאו הודעות. בואו נבדוק את הפורמט של הקובץ:")
-        st.code(content[:500])
-    
-    return pd.DataFrame(messages)
+# Bump whenever the parser output changes so stale cache entries are ignored
+PARSER_VERSION = "9"
+PARSE_CACHE_MAX_ENTRIES = 8
+PARSE_CACHE_MAX_BYTES = 1024 * 1024 * 1024
 
-def create_leaderboards(df):
-    """Create comprehensive leaderboards"""
-    leaderboards = {}
-    
-    # 1. Most messages
-    user_message_counts = df['sender'].value_counts()
-    leaderboards['most_messages'] = user_message_counts
-    
-    # 2. Most emojis
-    all_emojis = []
-    for message in df['message']:
-        all_emojis.extend(emoji.emoji_list(message))
-    emoji_counts = Counter([e['emoji'] for e in all_emojis])
-    leaderboards['most_emojis'] = emoji_counts.most_common(10)
-    
-    # 3. Longest messages
-    df['message_length'] = df['message'].str.len()
-    longest_messages = df.nlargest(10, 'message_length')[['sender', 'message', 'message_length', 'datetime']]
-    leaderboards['longest_messages'] = longest_messages
+@st.cache_resource
+def get_parse_cache():
+    """Process-wide LRU of parsed chats, shared across reruns and sessions"""
+    return {'entries': OrderedDict(), 'bytes': 0, 'lock': threading.Lock()}
+
+def load_chat(file_bytes, file_name):
+    """Parse an uploaded export, reusing the cached DataFrame for identical bytes.
+
+    Returns (cache key, df, count cube, token index, media manifest, preview, cache_hit). On a
+    miss the text is streamed through the chunked parser, or sharded across processes when
+    it is large, and the count cube and token index are built once next to it. Zips also
+    get their media manifest, read from the central directory (None for plain text);
+    preview holds the first characters when nothing was parsed.
+    """
+    cache = get_parse_cache()
+    key = (hashlib.blake2b(file_bytes, digest_size=20).hexdigest(), file_name.endswith('.zip'), PARSER_VERSION)
     
-    # 4. Most media messages
-    media_messages = df[df['message'].str.contains(r'<.*?>', na=False)]
-    media_counts = media_messages['sender'].value_counts()
-    leaderboards['most_media'] = media_counts
+    with cache['lock']:
+        if key in cache['entries']:
+            cache['entries'].move_to_end(key)
+            df, cube, tokens, manifest, _ = cache['entries'][key]
+            stage_timings.append({'stage': 'decode + parse', 'seconds': 0.0, 'rows': len(df), 'cache': 'hit'})
+            # Shallow copy so column additions downstream don't touch the cached frame
+            return key, df.copy(deep=False), cube, tokens, manifest, None, True
     
-    # 5. Most "haha" messages
-    haha_messages = df[df['message'].str.contains(r'חחח|haha|ההה|lol', case=False, na=False)]
-    haha_counts = haha_messages['sender'].value_counts()
-    leaderboards['most_haha'] = haha_counts
+    with timed_stage('zip extraction' if file_name.endswith('.zip') else 'read upload'):
+        stream, size = open_chat_stream(file_bytes, file_name)
+    if stream is None:
+        return key, None, None, None, None, None, False
+    # Decoding is streamed chunk by chunk inside the parser, so it is timed together with parsing
+    with stream, timed_stage('decode + parse') as stage:
+        if size >= PARALLEL_THRESHOLD_BYTES:
+            # Large exports are sharded across a process pool (when there are spare cores)
+            df = parse_whatsapp_bytes(file_bytes if isinstance(stream, io.BytesIO) else stream.read())
+        else:
+            df = parse_whatsapp_stream(stream)
+        stage.update(rows=len(df), cache='miss')
     
-    return leaderboards
-
-def create_time_breakdowns(df):
-    """Create time-based breakdowns"""
-    breakdowns = {}
+    preview = None
+    if df.empty:
+        stream, _ = open_chat_stream(file_bytes, file_name)
+        with stream:
+            preview = decode_export(stream.read(500))
     
-    # 1. Weekly breakdown (days of week)
-    df['weekday'] = df['datetime'].dt.day_name()
-    weekday_counts = df['weekday'].value_counts()
-    breakdowns['weekly'] = weekday_counts
+    manifest = None
+    if file_name.endswith('.zip'):
+        with timed_stage('media manifest') as stage:
+            manifest = read_media_manifest(io.BytesIO(file_bytes))
+            stage['rows'] = len(manifest)
     
-    # 2. Monthly breakdown (days of month)
-    df['day_of_month'] = df['datetime'].dt.day
-    day_counts = df['day_of_month'].value_counts().sort_index()
-    breakdowns['monthly'] = day_counts
+    with timed_stage('count cube'):
+        cube = build_count_cube(df)
+    with timed_stage('token index') as stage:
+        tokens = build_token_index(df)
+        stage['rows'] = len(tokens['count'])
+    size = int(df.memory_usage(deep=True).sum()) + sum(
+        values.nbytes for index in (cube, tokens) for values in index.values() if isinstance(values, np.ndarray)
+    )
     
-    # 3. Hourly breakdown
-    df['hour'] = df['datetime'].dt.hour
-    hour_counts = df['hour'].value_counts().sort_index()
-    breakdowns['hourly'] = hour_counts
+    with cache['lock']:
+        if key not in cache['entries']:
+            cache['entries'][key] = (df, cube, tokens, manifest, size)
+            cache['bytes'] += size
+        # Evict least recently used entries, always keeping the newest one
+        while len(cache['entries']) > 1 and (
+            len(cache['entries']) > PARSE_CACHE_MAX_ENTRIES or cache['bytes'] > PARSE_CACHE_MAX_BYTES
+        ):
+            _, (*_, evicted_size) = cache['entries'].popitem(last=False)
+            cache['bytes'] -= evicted_size
     
-    return breakdowns
+    return key, df.copy(deep=False), cube, tokens, manifest, preview, False
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def sync_upload_with_store(file_bytes, file_name):
+    """If the upload is an export of a saved chat, append its new messages to the store.
+
+    Only the head of the chat text is read (and re-encoded) to look for a
+    saved chat; the rest is read only when one matches. Cached per upload, so
+    reruns don't re-check. Returns (chat_id, rows added), or (None, 0) when
+    the upload isn't a saved chat.
+    """
+    stream, _ = open_chat_stream(file_bytes, file_name)
+    if stream is None:
+        return None, 0
+    with stream:
+        head = stream.read(IDENTITY_SAMPLE_BYTES)
+        utf8 = sniff_encoding(head[:ENCODING_SAMPLE_BYTES]) == 'utf-8-sig'
+        # The store matches and appends on UTF-8 bytes
+        sample = head if utf8 else decode_export(head).encode('utf-8')
+        if len(head) == IDENTITY_SAMPLE_BYTES:
+            # The chat goes on: drop the partial last line
+            sample = sample[:sample.rfind(b'\n') + 1]
+        meta = match_stored_chat(sample)
+        if meta is None:
+            return None, 0
+        data = file_bytes if isinstance(stream, io.BytesIO) else head + stream.read()
+    if not utf8:
+        data = decode_export(data).encode('utf-8')
+    meta, added = update_stored_chat(data, meta)
+    return meta['chat_id'], added
+
+@st.cache_resource(max_entries=4)
+def load_stored_token_index(chat_id, saved_at):
+    """Token index of a saved chat from its stored word counts; saved_at is part of the key so appends reload it"""
+    return token_index_from_counts(load_stored_token_counts(chat_id))
+
+@st.cache_resource
+def get_import_pool():
+    """Worker processes that parse and store multi-file uploads, kept across reruns"""
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+    return ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=context)
+
+def submit_import(fn, *args):
+    """Submit to the import pool, replacing it first if a worker died since it was last used"""
+    try:
+        return get_import_pool().submit(fn, *args)
+    except BrokenProcessPool:
+        get_import_pool.clear()
+        return get_import_pool().submit(fn, *args)
+
+@st.cache_resource
+def get_imported_uploads():
+    """(chat id, error) of every upload imported so far, by content hash"""
+    return {}
+
+def import_uploads(files):
+    """Store every uploaded export, parsing the ones not seen before concurrently in the import pool.
+
+    Exports are first grouped by chat (see export_identity). Each chat is
+    imported by a single task, its exports oldest first, so later exports
+    append to the first instead of racing it to save their own copy.
+    Returns the stored chat ids in upload order; exports that can't be
+    stored are reported in the sidebar and left out.
+    """
+    imported = get_imported_uploads()
+    digests = [hashlib.blake2b(file.getvalue(), digest_size=20).hexdigest() for file in files]
+    pending = {digest: file for digest, file in zip(digests, files) if digest not in imported}
+    # Uploads lost to a dead worker are reported but not remembered, so the next rerun retries them
+    crashed = {}
+
+    def worker_crashed(group):
+        # A worker died (out of memory on a huge export, say): the next rerun gets a fresh pool
+        get_import_pool.clear()
+        crashed.update(dict.fromkeys(group, (None, "import worker crashed, rerun to retry")))
+
+    identities = {digest: submit_import(export_identity, file.getvalue(), file.name) for digest, file in pending.items()}
+    chats = {}
+    for digest, future in identities.items():
+        try:
+            chat_id, size = future.result()
+        except BrokenProcessPool:
+            worker_crashed([digest])
+            continue
+        except Exception as e:
+            imported[digest] = (None, str(e))
+            continue
+        # An export without messages is imported alone, which reports it
+        chats.setdefault(chat_id or digest, []).append((size, digest))
+
+    futures = {}
+    for exports in chats.values():
+        # A later export of a chat holds more text
+        group = tuple(digest for _, digest in sorted(exports))
+        futures[group] = submit_import(import_exports, [(pending[digest].getvalue(), pending[digest].name) for digest in group])
+    for group, future in futures.items():
+        try:
+            results = future.result()
+        except BrokenProcessPool:
+            worker_crashed(group)
+            continue
+        for digest, (result, error) in zip(group, results):
+            imported[digest] = (None, error) if error else (result[0]['chat_id'], None)
+    chat_ids = []
+    for digest, file in zip(digests, files):
+        chat_id, error = imported.get(digest) or crashed[digest]
+        if error:
+            st.sidebar.error(f"{file.name}: {error}")
+        elif chat_id not in chat_ids:
+            chat_ids.append(chat_id)
+    return chat_ids
+
+@st.cache_resource(max_entries=256)
+def get_chat_summary(chat_id, saved_at):
+    """Comparison aggregates of a saved chat from its stored counts; saved_at is part of the key so appends refresh them"""
+    return chat_summary(load_stored_counts(chat_id))
+
+@st.cache_resource(max_entries=4)
+def get_stored_search(chat_id, saved_at):
+    """Search index of a saved chat; saved_at is part of the key so appends reopen it"""
+    return open_stored_search(chat_id)
 
-def get_interesting_facts(df, leaderboards):
-    """Generate interesting facts and insights"""
-    facts = []
+@st.cache_resource(max_entries=2)
+def get_upload_search(file_id, _df):
+    """In-memory search index of an uploaded chat, filled in batches on first use"""
+    search = open_search_index()
+    index_messages(search, _df)
+    return search
+
+def select_date_range(df, stored_chat_id, start=None, end=None):
+    """Messages with start <= datetime <= end; read from the local store when no frame is loaded"""
+    if df is None:
+        return load_stored_chat(stored_chat_id, start=start, end=end)
+    return filter_date_range(df, start, end)
+
+# Dashboard stages (filters, aggregates, figures) memoized on exactly the inputs they depend on
+STAGE_CACHE_MAX_ENTRIES = 64
+STAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+@st.cache_resource
+def get_stage_cache():
+    """Process-wide LRU of dashboard stage results, shared across reruns and sessions"""
+    return {'entries': OrderedDict(), 'bytes': 0, 'lock': threading.Lock()}
+
+def run_stage(name, key, compute):
+    """Result of compute() for this stage and key, computed once and then reused.
+
+    key holds every input the stage depends on: the key of the stage feeding it
+    plus its own widget values (and the language, for stages producing text or
+    figures). A widget change therefore only reruns the stages downstream of
+    it. Each call is a row of the diagnostics panel with its cache hit or miss.
+    """
+    cache = get_stage_cache()
+    entry_key = (name, key)
+    with timed_stage(name) as stage:
+        with cache['lock']:
+            if entry_key in cache['entries']:
+                cache['entries'].move_to_end(entry_key)
+                stage['cache'] = 'hit'
+                return cache['entries'][entry_key][0]
+        result = compute()
+        stage['cache'] = 'miss'
+        # Frames are the only large results; their views of the parsed chat are counted in full
+        size = sum(
+            int(value.memory_usage(deep=True).sum())
+            for value in (result if isinstance(result, tuple) else (result,)) if isinstance(value, pd.DataFrame)
+        )
+        with cache['lock']:
+            if entry_key not in cache['entries']:
+                cache['entries'][entry_key] = (result, size)
+                cache['bytes'] += size
+            # Evict least recently used entries, always keeping the newest one
+            while len(cache['entries']) > 1 and (
+                len(cache['entries']) > STAGE_CACHE_MAX_ENTRIES or cache['bytes'] > STAGE_CACHE_MAX_BYTES
+            ):
+                _, (_, evicted_size) = cache['entries'].popitem(last=False)
+                cache['bytes'] -= evicted_size
+        return result
+
+def breakdown_figure(data, title, x_label, color, is_hebrew):
+    """Bar chart of one time breakdown, with the value on each bar"""
+    fig = px.bar(
+        x=data.index,
+        y=data.values,
+        title=title,
+        labels={'x': x_label, 'y': 'הודעות' if is_hebrew else 'Messages'},
+        color_discrete_sequence=[color]
+    )
+    # Add value labels on bars
+    fig.update_traces(
+        texttemplate='%{y}',
+        textposition='outside'
+    )
+    fig.update_layout(height=300, showlegend=False)
+    return fig
+
+def activity_title(granularity, is_hebrew):
+    """Chart title of a daily, weekly or monthly activity curve"""
+    return {
+        'day': "פעילות יומית" if is_hebrew else "Daily Activity",
+        'week': "פעילות שבועית" if is_hebrew else "Weekly Activity",
+        'month': "פעילות חודשית" if is_hebrew else "Monthly Activity",
+    }[granularity]
+
+def activity_figure(cube, is_hebrew):
+    """Activity over time: daily, weekly or monthly points by span, peaks kept when downsampled.
+
+    The granularity keeps the line to a few hundred points, so it always renders as SVG.
+    """
+    daily_data = cube_counts(cube, 'day')
+    granularity = choose_granularity(daily_data.index[0], daily_data.index[-1]) if len(daily_data) else 'day'
+    activity_data = minmax_downsample(resample_counts(daily_data, granularity))
+    fig = px.line(
+        x=activity_data.index,
+        y=activity_data.values,
+        title=activity_title(granularity, is_hebrew),
+        labels={'x': 'תאריך' if is_hebrew else 'Date', 'y': 'הודעות' if is_hebrew else 'Messages'},
+    )
+    fig.update_layout(height=300, showlegend=False)
+    return fig
+
+def top_words_figure(top_words_list, is_hebrew):
+    """Small horizontal bar chart of (word, count) pairs"""
+    fig = px.bar(
+        x=[count for word, count in top_words_list],
+        y=[word for word, count in top_words_list],
+        orientation='h',
+        labels={'x': 'כמות' if is_hebrew else 'Count', 'y': 'מילה' if is_hebrew else 'Word'},
+        color_discrete_sequence=['#667eea']
+    )
+    fig.update_layout(height=max(250, 30 * len(top_words_list)), showlegend=False)
+    fig.update_traces(
+        texttemplate='%{x}',
+        textposition='outside'
+    )
+    return fig
+
+def weekly_change_figure(week_labels, week_counts, weekly_changes, is_hebrew):
+    """Weekly message bars with the week-over-week change % as a line on a second axis"""
+    import plotly.graph_objects as go
+
+    fig_combined = go.Figure()
+
+    # Add bars for message counts
+    fig_combined.add_trace(
+        go.Bar(
+            x=week_labels,
+            y=week_counts,
+            name="הודעות" if is_hebrew else "Messages",
+            marker_color='#667eea',
+            text=week_counts,
+            textposition='outside',
+            yaxis='y'
+        )
+    )
+
+    # Add line for percentage changes on secondary y-axis
+    fig_combined.add_trace(
+        go.Scatter(
+            x=week_labels,
+            y=weekly_changes,
+            name="אחוז שינוי" if is_hebrew else "Change %",
+            mode='lines+markers',
+            line=dict(color='#f093fb', width=3),
+            marker=dict(size=8),
+            text=[f"{p:.1f}%" for p in weekly_changes],
+            textposition='top center',
+            yaxis='y2'
+        )
+    )
+
+    fig_combined.update_layout(
+        height=400,
+        title="הודעות ואחוז שינוי שבועי" if is_hebrew else "Weekly Messages and Change Percentage",
+        xaxis_title="תאריכים" if is_hebrew else "Dates",
+        yaxis=dict(
+            title="הודעות" if is_hebrew else "Messages",
+            side='left',
+            showgrid=True
+        ),
+        yaxis2=dict(
+            title="אחוז שינוי" if is_hebrew else "Change %",
+            side='right',
+            overlaying='y',
+            showgrid=False
+        ),
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
+    )
+    return fig_combined
+
+def comparison_activity_figure(summaries, is_hebrew):
+    """One activity line per chat on a shared time axis, at the granularity the combined span allows"""
+    spans = [summary['daily'].index for summary in summaries.values() if len(summary['daily'])]
+    granularity = choose_granularity(min(span[0] for span in spans), max(span[-1] for span in spans)) if spans else 'day'
+    curves = pd.concat(
+        [
+            minmax_downsample(resample_counts(summary['daily'], granularity)).rename('messages').rename_axis('day').reset_index().assign(chat=label)
+            for label, summary in summaries.items()
+        ],
+        ignore_index=True
+    )
+    fig = px.line(
+        curves,
+        x='day',
+        y='messages',
+        color='chat',
+        title=activity_title(granularity, is_hebrew),
+        labels={'day': 'תאריך' if is_hebrew else 'Date', 'messages': 'הודעות' if is_hebrew else 'Messages', 'chat': "צ'אט" if is_hebrew else 'Chat'},
+        render_mode='webgl' if len(curves) > WEBGL_POINT_THRESHOLD else 'svg'
+    )
+    fig.update_layout(height=400, legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
+    return fig
+
+def overlap_figure(overlap, is_hebrew):
+    """Heatmap of members shared by each pair of chats"""
+    fig = px.imshow(
+        overlap,
+        text_auto=True,
+        color_continuous_scale='Purples',
+        labels={'color': 'חברים' if is_hebrew else 'Members'}
+    )
+    fig.update_layout(height=max(300, 150 + 40 * len(overlap)), coloraxis_showscale=False)
+    return fig
+
+# Sections that rerun on their own: their widgets only re-execute the section, reading the
+# state the last full run computed (passed in as arguments)
+@st.fragment
+def personal_analysis_section(df_filtered, leaderboards, media_totals, message_total, tokens, filter_key, date_key, range_start, range_end):
+    """Metrics and top words of one selected user"""
+    section_started = time.perf_counter()
+    users = df_filtered['sender'].unique()
+    selected_user = st.selectbox(select_user, options=users, key='personal_user')
     
-    if not df.empty:
-        total_messages = len(df)
-        total_users = df['sender'].nunique()
+    if selected_user:
+        user_stats = run_stage(
+            'personal analysis', (filter_key, selected_user),
+            lambda: create_user_stats(df_filtered, selected_user)
+        )
+        
+        # User stats
+        col1, col2, col3 = st.columns(3)
         
-        # Most active user percentage
-        most_active = leaderboards['most_messages'].index[0]
-        most_active_count = leaderboards['most_messages'].iloc[0]
-        most_active_percentage = (most_active_count / total_messages) * 100
+        user_message_count = int(leaderboards['most_messages'].get(selected_user, 0))
+        with col1:
+            st.metric(user_messages, user_message_count)
         
-        facts.append(f"👑 {most_active} מהווה {most_active_percentage:.1f}% מההודעות בקבוצה" if is_hebrew else f"👑 {most_active} represents {most_active_percentage:.1f}% of all messages")
+        with col2:
+            st.metric(user_emojis, user_stats['emojis'])
         
-        # Most active hour
-        most_active_hour = df['datetime'].dt.hour.value_counts().index[0]
-        facts.append(f"🕐 השעה הפעילה ביותר: {most_active_hour}:00" if is_hebrew else f"🕐 Most active hour: {most_active_hour}:00")
+        with col3:
+            st.metric(user_media, user_stats['media'])
+            if media_totals is not None and selected_user in media_totals.index:
+                files, total_bytes = media_totals.loc[selected_user, ['files', 'bytes']]
+                st.caption(
+                    f"📎 {files:,} קבצים, {total_bytes / 2**20:.1f}MB בארכיון" if is_hebrew
+                    else f"📎 {files:,} files, {total_bytes / 2**20:.1f}MB in the archive"
+                )
         
-        # Most active day
-        most_active_day = df['datetime'].dt.day_name().value_counts().index[0]
-        facts.append(f"📅 היום הפעיל ביותר: {most_active_day}" if is_hebrew else f"📅 Most active day: {most_active_day}")
+        # User percentage of total activity
+        user_percentage_of_total = (user_message_count / message_total) * 100
+        st.info(f"משתמש זה מהווה {user_percentage_of_total:.1f}% מהפעילות הכללית בקבוצה" if is_hebrew else f"This user represents {user_percentage_of_total:.1f}% of total group activity")
         
-        # Average messages per day
-        avg_per_day = total_messages / df['datetime'].dt.date.nunique()
-        facts.append(f"📊 ממוצע יומי: {avg_per_day:.1f} הודעות" if is_hebrew else f"📊 Daily average: {avg_per_day:.1f} messages")
+        # Additional user stats
+        col1, col2 = st.columns(2)
         
-        # Most emoji user
-        if leaderboards['most_emojis']:
-            top_emoji = leaderboards['most_emojis'][0][0]
-            facts.append(f"😄 האימוג'י הפופולרי ביותר: {top_emoji}" if is_hebrew else f"😄 Most popular emoji: {top_emoji}")
-    
-    return facts
+        with col1:
+            # Average message length (characters)
+            st.metric("אורך ממוצע (תווים)" if is_hebrew else "Avg Length (chars)", f"{user_stats['avg_chars']:.1f}")
+            
+            # Average message length (words)
+            st.metric("אורך ממוצע (מילים)" if is_hebrew else "Avg Length (words)", f"{user_stats['avg_words']:.1f}")
+        
+        with col2:
+            # Removed emoji metric due to display issues
+            pass
+        
+        # Top words, sliced from the chat's token index to the current dates and user
+        top_words_count = st.slider(
+            "מספר מילים נפוצות" if is_hebrew else "Number of top words",
+            min_value=5, max_value=30, value=5, key='top_words_count'
+        )
+        st.markdown("#### " + (f"{top_words_count} המילים הנפוצות ביותר" if is_hebrew else f"Top {top_words_count} Words"))
+        top_words_key = (date_key, selected_user, top_words_count)
+        top_words_list = run_stage(
+            'top words', top_words_key,
+            lambda: top_words(slice_cube(tokens, range_start, range_end, senders=[selected_user]), top_words_count)
+        )
+        
+        if top_words_list:
+            # Display as a small horizontal bar chart
+            fig_top_words = run_stage(
+                'chart: top words', (top_words_key, is_hebrew), lambda: top_words_figure(top_words_list, is_hebrew)
+            )
+            st.plotly_chart(fig_top_words, use_container_width=True)
+        else:
+            st.info("אין מספיק מילים לניתוח" if is_hebrew else "Not enough words for analysis")
+    section_timing('personal analysis', section_started)
 
-def create_fun_facts(df, leaderboards):
-    """Create fun and humorous insights"""
-    facts = []
+@st.fragment
+def leaderboards_section(leaderboards, media_totals):
+    """The five leaderboard tabs; media also lists archive files and sizes when the upload had them"""
+    tab1, tab2, tab3, tab4, tab5 = st.tabs([
+        "📱 " + messages_leaderboard,
+        "😄 " + most_emojis,
+        "📝 " + longest_messages,
+        "🖼️ " + most_media,
+        "😆 " + most_haha
+    ])
     
-    if df.empty:
-        return facts
+    with tab1:
+        most_messages_df = leaderboards['most_messages'].reset_index()
+        most_messages_df.columns = ['משתמש' if is_hebrew else 'User', 'הודעות' if is_hebrew else 'Messages']
+        most_messages_df['אחוז' if is_hebrew else 'Percentage'] = (most_messages_df['הודעות' if is_hebrew else 'Messages'] / most_messages_df['הודעות' if is_hebrew else 'Messages'].sum() * 100).round(1)
+        st.dataframe(most_messages_df, use_container_width=True)
     
-    # Top chatter
-    top_chatter = leaderboards['most_messages'].index[0]
-    if is_hebrew:
-        facts.append(f"🏆 {top_chatter}: {leaderboards['most_messages'].iloc[0]} הודעות - {explanation_top_chatter}")
-    else:
-        facts.append(f"🏆 {top_chatter}: {leaderboards['most_messages'].iloc[0]} messages - {explanation_top_chatter}")
+    with tab2:
+        emoji_df = pd.DataFrame(leaderboards['most_emojis'], columns=['אימוגי' if is_hebrew else 'Emoji', 'כמות' if is_hebrew else 'Count'])
+        st.dataframe(emoji_df, use_container_width=True)
     
-    # The digger (longest message)
-    if not leaderboards['longest_messages'].empty:
-        digger = leaderboards['longest_messages'].iloc[0]
-        if is_hebrew:
-            facts.append(f"📚 {digger['sender']}: {digger['message_length']} תווים - {explanation_digger}")
-        else:
-            facts.append(f"📚 {digger['sender']}: {digger['message_length']} characters - {explanation_digger}")
-    
-    # Emoji king/queen
-    emoji_counts = {}
-    emoji_pattern = re.compile("["
-        u"\U0001F600-\U0001F64F"  # emoticons
-        u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-        u"\U0001F680-\U0001F6FF"  # transport & map symbols
-        u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        u"\U00002702-\U000027B0"
-        u"\U000024C2-\U0001F251"
-        "]+", flags=re.UNICODE)
+    with tab3:
+        longest_df = leaderboards['longest_messages'][['sender', 'message', 'message_length']].copy()
+        longest_df.columns = ['משתמש' if is_hebrew else 'User', 'הודעה' if is_hebrew else 'Message', 'אורך' if is_hebrew else 'Length']
+        st.dataframe(longest_df, use_container_width=True)
     
-    for sender in df['sender'].unique():
-        user_messages = df[df['sender'] == sender]['message'].str.cat(sep=' ')
-        emoji_counts[sender] = len(emoji_pattern.findall(user_messages))
+    with tab4:
+        media_df = leaderboards['most_media'].reset_index()
+        media_df.columns = ['משתמש' if is_hebrew else 'User', 'כמות' if is_hebrew else 'Count']
+        if media_totals is not None:
+            attached = media_totals.reindex(media_df.iloc[:, 0].astype(str))
+            media_df['קבצים' if is_hebrew else 'Files'] = attached['files'].fillna(0).astype(int).to_numpy()
+            media_df['MB'] = (attached['bytes'].fillna(0) / 2**20).round(1).to_numpy()
+        st.dataframe(media_df, use_container_width=True)
     
-    if emoji_counts:
-        emoji_king = max(emoji_counts, key=emoji_counts.get)
-        if is_hebrew:
-            facts.append(f"👑 {emoji_king}: {emoji_counts[emoji_king]} אימוג'י - {explanation_emoji_king}")
+    with tab5:
+        haha_df = leaderboards['most_haha'].reset_index()
+        haha_df.columns = ['משתמש' if is_hebrew else 'User', 'כמות' if is_hebrew else 'Count']
+        st.dataframe(haha_df, use_container_width=True)
+
+@st.fragment
+def search_section(df, selected_users, range_start, range_end):
+    """Full-text search box with paged results, limited to the selected dates and users"""
+    section_started = time.perf_counter()
+    search_text = st.text_input(search_messages_title, placeholder=search_placeholder, label_visibility="collapsed", key='search_text')
+    if search_text:
+        if stored_chat_id:
+            search_index = get_stored_search(stored_chat_id, stored_chats[stored_chat_id]['saved_at'])
         else:
-            facts.append(f"👑 {emoji_king}: {emoji_counts[emoji_king]} emojis - {explanation_emoji_king}")
+            search_index = get_upload_search(uploaded_file.file_id, df)
+        # Keyed by the query so a new search starts from the first page
+        search_page = st.number_input(results_page, min_value=1, value=1, step=1, key=f"search_page:{search_text}") - 1
+        with timed_stage('search') as stage:
+            results, total_results = search_messages(
+                search_index, search_text,
+                senders=selected_users or None, start=range_start, end=range_end,
+                page=search_page, page_size=DEFAULT_PAGE_SIZE
+            )
+            stage['rows'] = total_results
+        pages = max(1, -(-total_results // DEFAULT_PAGE_SIZE))
+        st.caption(
+            f"{total_results:,} תוצאות · עמוד {search_page + 1} מתוך {pages}" if is_hebrew
+            else f"{total_results:,} results · page {search_page + 1} of {pages}"
+        )
+        if not results.empty:
+            results.columns = ['זמן' if is_hebrew else 'Time', 'משתמש' if is_hebrew else 'User', 'הודעה' if is_hebrew else 'Message']
+            st.dataframe(results, use_container_width=True, hide_index=True)
+    section_timing('search', section_started)
+
+@st.fragment
+def weekly_change_section(cube_filtered, filter_key):
+    """Weekly messages and change % over the chosen number of last days"""
+    section_started = time.perf_counter()
+    weekly_window = st.slider(
+        "ימים אחרונים" if is_hebrew else "Last days",
+        min_value=14, max_value=365, value=DEFAULT_WEEKLY_WINDOW_DAYS, step=7, key='weekly_window'
+    )
     
-    # The ghost (least active)
-    ghost = leaderboards['most_messages'].index[-1]
-    if is_hebrew:
-        facts.append(f"👻 {ghost}: {leaderboards['most_messages'].iloc[-1]} הודעות - {explanation_ghost}")
+    # Calendar weeks keyed by (ISO year, week), computed from the count cube in one pass
+    weekly_key = (filter_key, weekly_window)
+    weekly = run_stage('weekly activity', weekly_key, lambda: weekly_activity(cube_filtered, window_days=weekly_window))
+    
+    if weekly['messages'].sum() > 0:
+        if len(weekly) > 1:
+            changed_weeks = weekly.iloc[1:]
+            weekly_changes = changed_weeks['change_percent'].tolist()
+            week_counts = changed_weeks['messages'].tolist()
+            
+            # Date range label per week: first to last day with messages
+            week_labels = [
+                f"{first_day:%d/%m}-{last_day:%d/%m}" if pd.notna(first_day)
+                else (f"שבוע {week}/{iso_year}" if is_hebrew else f"Week {week}/{iso_year}")
+                for (iso_year, week), first_day, last_day in zip(
+                    changed_weeks.index, changed_weeks['first_day'], changed_weeks['last_day']
+                )
+            ]
+            
+            if weekly_changes:
+                # Create single chart with bars and line overlay
+                fig_combined = run_stage(
+                    'chart: weekly change', (weekly_key, is_hebrew),
+                    lambda: weekly_change_figure(week_labels, week_counts, weekly_changes, is_hebrew)
+                )
+                st.plotly_chart(fig_combined, use_container_width=True)
+            else:
+                st.info("אין מספיק נתונים לחישוב שינויים שבועיים" if is_hebrew else "Not enough data for weekly changes")
+        else:
+            st.info("אין מספיק שבועות לניתוח" if is_hebrew else "Not enough weeks for analysis")
     else:
-        facts.append(f"👻 {ghost}: {leaderboards['most_messages'].iloc[-1]} messages - {explanation_ghost}")
+        st.info(f"אין נתונים ב-{weekly_window} הימים האחרונים" if is_hebrew else f"No data in last {weekly_window} days")
+    section_timing('weekly change', section_started)
+
+def section_timing(section, started):
+    """With diagnostics on, the section's own run time (the panel only covers full reruns)"""
+    if show_diagnostics:
+        st.caption(f"⏱️ {section}: {(time.perf_counter() - started) * 1000:.0f}ms")
+
+def comparison_view(chat_ids):
+    """Saved chats side by side: activity curves, leaderboards and shared members.
+
+    Everything is drawn from per-chat aggregates cached by (chat id, saved_at),
+    so adding a chat only summarizes that chat.
+    """
+    metas = [stored_chats[chat_id] for chat_id in chat_ids]
+    # Chats are labelled by name, with the id added when two share one
+    names = [meta['name'] for meta in metas]
+    labels = [name if names.count(name) == 1 else f"{name} ({meta['chat_id'][:6]})" for name, meta in zip(names, metas)]
+    with timed_stage('chat summaries') as stage:
+        summaries = {label: get_chat_summary(meta['chat_id'], meta['saved_at']) for label, meta in zip(labels, metas)}
+        stage['rows'] = len(summaries)
+    compare_key = tuple((meta['chat_id'], meta['saved_at']) for meta in metas)
+    comparison = run_stage('compare chats', compare_key, lambda: compare_chats(summaries))
+    leaderboard = comparison['leaderboard']
+    members = comparison['members']
     
-    # Good morning champion
-    morning_keywords = ['בוקר טוב', 'good morning', 'בוקר', 'morning']
-    morning_counts = {}
-    for sender in df['sender'].unique():
-        user_messages = df[df['sender'] == sender]['message'].str.lower()
-        morning_counts[sender] = sum(1 for msg in user_messages if any(keyword in msg for keyword in morning_keywords))
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("צ'אטים" if is_hebrew else "Chats", len(summaries))
+    with col2:
+        st.metric(total_messages, f"{leaderboard['messages'].sum():,}")
+    with col3:
+        st.metric(participants, len(set().union(*(summary['senders'].index for summary in summaries.values()))))
+    with col4:
+        st.metric(members_across_chats, len(members))
     
-    if morning_counts and max(morning_counts.values()) > 0:
-        morning_champion = max(morning_counts, key=morning_counts.get)
-        if is_hebrew:
-            facts.append(f"🌅 {morning_champion}: {morning_counts[morning_champion]} פעמים - {explanation_morning_champion}")
-        else:
-            facts.append(f"🌅 {morning_champion}: {morning_counts[morning_champion]} times - {explanation_morning_champion}")
+    # Activity curves
+    st.markdown(f'<div class="section-header">📈 {compare_activity}</div>', unsafe_allow_html=True)
+    fig_activity = run_stage(
+        'chart: compared activity', (compare_key, is_hebrew), lambda: comparison_activity_figure(summaries, is_hebrew)
+    )
+    st.plotly_chart(fig_activity, use_container_width=True)
     
-    # Sticker addict
-    sticker_keywords = ['<Media omitted>', 'sticker']
-    sticker_counts = {}
-    for sender in df['sender'].unique():
-        user_messages = df[df['sender'] == sender]['message'].str.lower()
-        sticker_counts[sender] = sum(1 for msg in user_messages if any(keyword in msg for keyword in sticker_keywords))
+    # Chats leaderboard
+    st.markdown(f'<div class="section-header">🏆 {chats_leaderboard}</div>', unsafe_allow_html=True)
+    leaderboard_df = leaderboard.reset_index()
+    leaderboard_df.columns = [
+        "צ'אט" if is_hebrew else 'Chat', total_messages, participants, active_days, messages_per_day,
+        'הודעה ראשונה' if is_hebrew else 'First Message', 'הודעה אחרונה' if is_hebrew else 'Last Message',
+        most_active_user,
+    ]
+    st.dataframe(leaderboard_df, use_container_width=True, hide_index=True)
     
-    if sticker_counts and max(sticker_counts.values()) > 0:
-        sticker_addict = max(sticker_counts, key=sticker_counts.get)
-        if is_hebrew:
-            facts.append(f"🎯 {sticker_addict}: {sticker_counts[sticker_addict]} מדיה - {explanation_sticker_addict}")
+    # Shared members
+    st.markdown(f'<div class="section-header">🤝 {shared_members}</div>', unsafe_allow_html=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        fig_overlap = run_stage(
+            'chart: member overlap', (compare_key, is_hebrew), lambda: overlap_figure(comparison['overlap'], is_hebrew)
+        )
+        st.plotly_chart(fig_overlap, use_container_width=True)
+    with col2:
+        st.markdown("#### " + members_across_chats)
+        if members.empty:
+            st.info("אין חברים משותפים" if is_hebrew else "No shared members")
         else:
-            facts.append(f"🎯 {sticker_addict}: {sticker_counts[sticker_addict]} media - {explanation_sticker_addict}")
-    
-    return facts
+            members_df = members.reset_index()
+            members_df.columns = ['משתמש' if is_hebrew else 'User', "צ'אטים" if is_hebrew else 'Chats', 'הודעות' if is_hebrew else 'Messages']
+            st.dataframe(members_df, use_container_width=True, hide_index=True)
 
 # Instructions for exporting WhatsApp chat
 st.markdown("## 📋 " + ("איך לייצא צ'אט מווטסאפ" if is_hebrew else "How to Export WhatsApp Chat"))
@@ -454,415 +965,313 @@ st.markdown("""
 - הקובץ צריך להיות בפורמט ווטסאפ סטנדרטי
 - מומלץ לייצא 'ללא מדיה' לביצועים טובים יותר
 - הקובץ יכול להיות גדול - זה בסדר
+- אפשר להעלות כמה קבצים יחד כדי להשוות בין צ'אטים
 """)
 
-# File upload
-uploaded_file = st.file_uploader(upload_label, type=['txt', 'zip'])
+try:
+    # File upload: one export opens its dashboard, several are stored and compared
+    uploaded_files = st.file_uploader(upload_label, type=['txt', 'zip'], accept_multiple_files=True) or []
+    uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
+    compared_chat_ids = []
+    if len(uploaded_files) > 1:
+        with st.spinner(processing_label), timed_stage('import uploads') as stage:
+            compared_chat_ids = import_uploads(uploaded_files)
+            stage['rows'] = len(compared_chat_ids)
 
-if uploaded_file:
-    with st.spinner(processing_label):
-        if uploaded_file.name.endswith(".zip"):
-            content = extract_txt_from_zip(uploaded_file.read())
-            if not content:
-                st.error("לא ניתן לקרוא קובץ מהארכיון" if is_hebrew else "Cannot read file from archive")
-                st.stop()
-        else:
-            content = uploaded_file.read().decode('utf-8')
+    # Newer exports of a saved chat only parse and append their new tail
+    synced_chat_id, synced_rows = None, 0
+    if uploaded_file:
+        with timed_stage('store sync'):
+            synced_chat_id, synced_rows = sync_upload_with_store(uploaded_file.getvalue(), uploaded_file.name)
+
+    # Chats parsed earlier and saved to the local store load without re-parsing
+    stored_chats = {meta['chat_id']: meta for meta in list_stored_chats()}
+    stored_chat_id = None
+    if stored_chats:
+        st.sidebar.markdown("### 💾 " + saved_chats)
+        stored_chat_id = st.sidebar.selectbox(
+            open_saved_chat,
+            [None] + list(stored_chats),
+            format_func=lambda chat_id: (compare_uploads_option if compared_chat_ids else uploaded_file_option) if chat_id is None
+            else f"{stored_chats[chat_id]['name']} ({stored_chats[chat_id]['rows']:,})",
+            key='stored_chat_id'
+        )
+
+    if synced_chat_id and not stored_chat_id:
+        stored_chat_id = synced_chat_id
+        st.sidebar.caption(
+            f"🔄 הקובץ מזוהה כצ'אט שמור - נוספו {synced_rows:,} הודעות חדשות" if is_hebrew
+            else f"🔄 Recognized as a saved chat - {synced_rows:,} new messages appended"
+        )
+
+    if compared_chat_ids and not stored_chat_id:
+        import plotly.express as px
+    
+        st.markdown(f'<div class="section-header">⚖️ {compare_title}</div>', unsafe_allow_html=True)
+        comparison_view([chat_id for chat_id in compared_chat_ids if chat_id in stored_chats])
+
+    elif uploaded_file or stored_chat_id:
+        # Charts are only drawn once a chat is loaded, so the landing page doesn't pay for plotly
+        import plotly.express as px
+
+        with st.spinner(processing_label):
+            if stored_chat_id:
+                # Date ranges below read only the month partitions they need; attachments aren't stored
+                df = manifest = None
+                stored_meta = stored_chats[stored_chat_id]
+                chat_key = ('stored', stored_chat_id, stored_meta['saved_at'])
+                cube = run_stage('count cube', chat_key, lambda: cube_from_counts(load_stored_counts(stored_chat_id)))
+                with timed_stage('token index') as stage:
+                    tokens = load_stored_token_index(stored_chat_id, stored_meta['saved_at'])
+                    stage['rows'] = len(tokens['count'])
+                first_datetime = pd.Timestamp(stored_meta['first_timestamp'])
+                last_datetime = pd.Timestamp(stored_meta['last_timestamp'])
+            else:
+                # Parse content (cached by content hash, so widget reruns skip parsing)
+                chat_key, df, cube, tokens, manifest, preview, cache_hit = load_chat(uploaded_file.getvalue(), uploaded_file.name)
+                if df is None:
+                    st.error("לא ניתן לקרוא קובץ מהארכיון" if is_hebrew else "Cannot read file from archive")
+                    raise StopPage
+            
+                if cache_hit:
+                    st.sidebar.caption("⚡ " + ("הקובץ נטען מהמטמון" if is_hebrew else "Loaded from parse cache"))
+            
+                timestamp_format = df.attrs.get('timestamp_format')
+                if timestamp_format:
+                    date_pattern = {'DMY': 'DD/MM', 'MDY': 'MM/DD', 'YMD': 'YYYY-MM-DD'}[timestamp_format['date_order']]
+                    year_digits = timestamp_format['year_digits']
+                    clock = timestamp_format['clock']
+                    st.sidebar.caption(
+                        f"🕒 פורמט תאריך שזוהה: {date_pattern}, שנה בת {year_digits} ספרות, {clock}" if is_hebrew
+                        else f"🕒 Detected date format: {date_pattern}, {year_digits}-digit year, {clock}"
+                    )
+            
+                memory_bytes = df.attrs.get('memory_bytes')
+                if memory_bytes:
+                    parsed_mb = memory_bytes['parsed'] / 2**20
+                    compact_mb = memory_bytes['compact'] / 2**20
+                    features_mb = memory_bytes['features'] / 2**20
+                    st.sidebar.caption(
+                        f"💾 זיכרון: {compact_mb:.1f}MB (לפני דחיסה {parsed_mb:.1f}MB) + {features_mb:.1f}MB מאפייני הודעות" if is_hebrew
+                        else f"💾 Memory: {compact_mb:.1f}MB (was {parsed_mb:.1f}MB before compaction) + {features_mb:.1f}MB message features"
+                    )
+            
+                if manifest is not None and not manifest.empty:
+                    kind_counts = manifest['kind'].value_counts()
+                    kinds = ", ".join(f"{count:,} {kind}" for kind, count in kind_counts[kind_counts > 0].items())
+                    archive_mb = manifest['bytes'].sum() / 2**20
+                    st.sidebar.caption(
+                        f"📎 מדיה בארכיון: {len(manifest):,} קבצים, {archive_mb:.1f}MB ({kinds})" if is_hebrew
+                        else f"📎 Archive media: {len(manifest):,} files, {archive_mb:.1f}MB ({kinds})"
+                    )
+            
+                if df.empty:
+                    # Debug: Show first few lines if no messages found
+                    if preview:
+                        st.warning("לא נמצאו הודעות. בואו נבדוק את הפורמט של הקובץ:")
+                        st.code(preview)
+                    st.error("לא נמצאו הודעות בקובץ" if is_hebrew else "No messages found in file")
+                    raise StopPage
+            
+                first_datetime = df['datetime'].iloc[0]
+                last_datetime = df['datetime'].iloc[-1]
+            
+                if st.sidebar.button(save_chat):
+                    saved_meta = save_stored_chat(df, uploaded_file.name)
+                    st.sidebar.success(
+                        f"נשמר: {saved_meta['rows']:,} הודעות" if is_hebrew
+                        else f"Saved: {saved_meta['rows']:,} messages"
+                    )
         
-        # Parse content
-        df = parse_whatsapp_content(content)
+            # Date range filter
+            st.markdown(f'<div class="section-header">📅 {date_range}</div>', unsafe_allow_html=True)
         
-        if df.empty:
-            st.error("לא נמצאו הודעות בקובץ" if is_hebrew else "No messages found in file")
-            st.stop()
+            # Widgets are keyed and their options are language-neutral, so flipping the language keeps every selection
+            date_option_labels = {'last_60_days': last_60_days, 'all_time': all_time, 'custom_range': custom_range}
+            date_option = st.selectbox(
+                "בחר טווח תאריכים" if is_hebrew else "Select date range",
+                list(date_option_labels),
+                format_func=date_option_labels.get,
+                index=0,
+                key='date_option'
+            )
         
-        # Date range filter
-        st.markdown(f'<div class="section-header">📅 {date_range}</div>', unsafe_allow_html=True)
+            # Day-aligned bounds, so the message frame and the count cube cover the same range
+            range_start = range_end = None
+            if date_option == 'last_60_days':
+                range_start = (last_datetime - timedelta(days=60)).normalize()
+            elif date_option == 'custom_range':
+                col1, col2 = st.columns(2)
+                with col1:
+                    start_date = st.date_input("תאריך התחלה" if is_hebrew else "Start date", value=first_datetime.date(), key=f"start_date:{chat_key}")
+                with col2:
+                    end_date = st.date_input("תאריך סיום" if is_hebrew else "End date", value=last_datetime.date(), key=f"end_date:{chat_key}")
+                # Whole days: from the start date's midnight up to the end of the end date
+                range_start = pd.Timestamp(start_date)
+                range_end = pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
         
-        date_option = st.selectbox(
-            "בחר טווח תאריכים" if is_hebrew else "Select date range",
-            [last_60_days, all_time, custom_range],
-            index=0
-        )
+            def filter_dates():
+                df_range = select_date_range(df, stored_chat_id, start=range_start, end=range_end)
+                return df_range, slice_cube(cube, range_start, range_end), list(df_range['sender'].unique())
+        
+            date_key = (chat_key, range_start, range_end)
+            df_dated, cube_dated, all_users = run_stage('date filter', date_key, filter_dates)
+            if df_dated.empty:
+                st.warning("אין נתונים בטווח התאריכים שנבחר" if is_hebrew else "No data in selected date range")
+                range_start = range_end = None
+                date_key = (chat_key, range_start, range_end)
+                df_dated, cube_dated, all_users = run_stage('date filter', date_key, filter_dates)
+        
+            # User filter, keyed by its options: a range with other senders starts again from everyone selected
+            st.markdown("### " + ("סינון משתמשים" if is_hebrew else "User Filter"))
+            users_id = hashlib.blake2b('\x1f'.join(map(str, all_users)).encode('utf-8'), digest_size=8).hexdigest()
+            selected_users = st.multiselect(
+                "בחר משתמשים" if is_hebrew else "Select users",
+                options=all_users,
+                default=all_users,
+                help="בחר משתמשים לניתוח. אם לא נבחר אף אחד, יוצגו כל המשתמשים." if is_hebrew else "Select users for analysis. If none selected, all users will be shown.",
+                key=f"selected_users:{users_id}"
+            )
+        
+            # Filter by selected users (all or none selected leaves the date-filtered frame as is)
+            def filter_users():
+                if not selected_users or len(selected_users) == len(all_users):
+                    return df_dated, cube_dated
+                return df_dated[df_dated['sender'].isin(selected_users)], slice_cube(cube_dated, senders=selected_users)
+        
+            filter_key = (date_key, tuple(sorted(map(str, selected_users))))
+            df_filtered, cube_filtered = run_stage('user filter', filter_key, filter_users)
+        
+            # Create leaderboards and breakdowns; time-based figures are reductions of the count cube.
+            # Only text and figures depend on the language, so a language flip reuses every aggregate.
+            leaderboards = run_stage('create_leaderboards', filter_key, lambda: create_leaderboards(df_filtered, cube_filtered))
+            # Files really attached per sender, from the zip's media manifest
+            media_totals = None
+            if manifest is not None and not manifest.empty:
+                media_totals = run_stage('media by sender', filter_key, lambda: media_by_sender(df_filtered, manifest))
+            breakdowns = run_stage('create_time_breakdowns', filter_key, lambda: create_time_breakdowns(cube_filtered))
+            facts = run_stage(
+                'facts', (filter_key, is_hebrew),
+                lambda: get_interesting_facts(cube_filtered, breakdowns, leaderboards, is_hebrew)
+            )
+            message_total = int(leaderboards['most_messages'].sum())
+            active_day_count = cube_active_days(cube_filtered)
+        
+            # Display metrics
+            col1, col2, col3, col4 = st.columns(4)
         
-        if date_option == last_60_days:
-            latest_date = df['datetime'].max()
-            sixty_days_ago = latest_date - timedelta(days=60)
-            df_filtered = df[df['datetime'] >= sixty_days_ago]
-        elif date_option == custom_range:
-            col1, col2 = st.columns(2)
             with col1:
-                start_date = st.date_input("תאריך התחלה" if is_hebrew else "Start date", value=df['datetime'].min().date())
+                st.metric(total_messages, f"{message_total:,}")
+        
             with col2:
-                end_date = st.date_input("תאריך סיום" if is_hebrew else "End date", value=df['datetime'].max().date())
-            df_filtered = df[(df['datetime'].dt.date >= start_date) & (df['datetime'].dt.date <= end_date)]
-        else:
-            df_filtered = df
-        
-        if df_filtered.empty:
-            st.warning("אין נתונים בטווח התאריכים שנבחר" if is_hebrew else "No data in selected date range")
-            df_filtered = df
-        
-        # User filter
-        st.markdown("### " + ("סינון משתמשים" if is_hebrew else "User Filter"))
-        all_users = df_filtered['sender'].unique()
-        selected_users = st.multiselect(
-            "בחר משתמשים" if is_hebrew else "Select users",
-            options=all_users,
-            default=all_users,
-            help="בחר משתמשים לניתוח. אם לא נבחר אף אחד, יוצגו כל המשתמשים." if is_hebrew else "Select users for analysis. If none selected, all users will be shown."
-        )
+                st.metric(participants, len(leaderboards['most_messages']))
         
-        # Filter by selected users
-        if selected_users:
-            df_filtered = df_filtered[df_filtered['sender'].isin(selected_users)]
+            with col3:
+                st.metric(active_days, active_day_count)
         
-        # Create leaderboards and breakdowns
-        leaderboards = create_leaderboards(df_filtered)
-        breakdowns = create_time_breakdowns(df_filtered)
-        facts = get_interesting_facts(df_filtered, leaderboards)
+            with col4:
+                avg_per_day = message_total / active_day_count
+                st.metric(messages_per_day, f"{avg_per_day:.1f}")
         
-        # Display metrics
-        col1, col2, col3, col4 = st.columns(4)
+            # Interesting facts
+            st.markdown(f'<div class="section-header">💡 {interesting_facts}</div>', unsafe_allow_html=True)
+            for fact in facts:
+                st.info(fact)
         
-        with col1:
-            st.metric(total_messages, f"{len(df_filtered):,}")
         
-        with col2:
-            st.metric(participants, df_filtered['sender'].nunique())
         
-        with col3:
-            st.metric(active_days, df_filtered['datetime'].dt.date.nunique())
+            # Personal Analysis
+            st.markdown(f'<div class="section-header">👤 {personal_analysis}</div>', unsafe_allow_html=True)
         
-        with col4:
-            avg_per_day = len(df_filtered) / df_filtered['datetime'].dt.date.nunique()
-            st.metric(messages_per_day, f"{avg_per_day:.1f}")
+            personal_analysis_section(df_filtered, leaderboards, media_totals, message_total, tokens, filter_key, date_key, range_start, range_end)
         
-        # Interesting facts
-        st.markdown(f'<div class="section-header">💡 {interesting_facts}</div>', unsafe_allow_html=True)
-        for fact in facts:
-            st.info(fact)
+            # Fun Facts
+            st.markdown(f'<div class="section-header">🎭 {fun_facts}</div>', unsafe_allow_html=True)
+            fun_facts_list = run_stage(
+                'fun facts', (filter_key, is_hebrew), lambda: create_fun_facts(df_filtered, leaderboards, is_hebrew)
+            )
         
-
+            for fact in fun_facts_list:
+                st.markdown(f'<div class="metric-card">{fact}</div>', unsafe_allow_html=True)
         
-        # Personal Analysis
-        st.markdown(f'<div class="section-header">👤 {personal_analysis}</div>', unsafe_allow_html=True)
+            # Leaderboards
+            st.markdown(f'<div class="section-header">{leaderboard_title}</div>', unsafe_allow_html=True)
         
-        users = df_filtered['sender'].unique()
-        selected_user = st.selectbox(select_user, options=users)
+            leaderboards_section(leaderboards, media_totals)
         
-        if selected_user:
-            user_data = df_filtered[df_filtered['sender'] == selected_user]
-            
-            # User stats
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                st.metric(user_messages, len(user_data))
-            
-            with col2:
-                # Count emojis using regex pattern
-                emoji_pattern = re.compile("["
-                    u"\U0001F600-\U0001F64F"  # emoticons
-                    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                    u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                    u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                    u"\U00002702-\U000027B0"
-                    u"\U000024C2-\U0001F251"
-                    "]+", flags=re.UNICODE)
-                emoji_count = len(emoji_pattern.findall(' '.join(user_data['message'])))
-                st.metric(user_emojis, emoji_count)
-            
-            with col3:
-                media_count = sum(1 for msg in user_data['message'] if '<Media omitted>' in str(msg))
-                st.metric(user_media, media_count)
-            
-            # User percentage of total activity
-            user_percentage_of_total = (len(user_data) / len(df_filtered)) * 100
-            st.info(f"משתמש זה מהווה {user_percentage_of_total:.1f}% מהפעילות הכללית בקבוצה" if is_hebrew else f"This user represents {user_percentage_of_total:.1f}% of total group activity")
-            
-            # Additional user stats
+            # Message search (FTS5), limited to the selected dates and users
+            st.markdown(f'<div class="section-header">🔎 {search_messages_title}</div>', unsafe_allow_html=True)
+            search_section(df, selected_users, range_start, range_end)
+        
+            # Time breakdowns
+            st.markdown(f'<div class="section-header">📊 פילוח לפי זמן</div>', unsafe_allow_html=True)
+        
+            figure_key = (filter_key, is_hebrew)
             col1, col2 = st.columns(2)
-            
+        
             with col1:
-                # Average message length (characters)
-                avg_chars = user_data['message'].str.len().mean()
-                st.metric("אורך ממוצע (תווים)" if is_hebrew else "Avg Length (chars)", f"{avg_chars:.1f}")
-                
-                # Average message length (words)
-                avg_words = user_data['message'].str.split().str.len().mean()
-                st.metric("אורך ממוצע (מילים)" if is_hebrew else "Avg Length (words)", f"{avg_words:.1f}")
+                # Weekly breakdown
+                fig_weekly = run_stage('chart: weekday', figure_key, lambda: breakdown_figure(
+                    breakdowns['weekly'], weekly_breakdown, 'יום' if is_hebrew else 'Day', '#667eea', is_hebrew
+                ))
+                st.plotly_chart(fig_weekly, use_container_width=True)
             
+                # Monthly breakdown
+                fig_monthly = run_stage('chart: day of month', figure_key, lambda: breakdown_figure(
+                    breakdowns['monthly'], monthly_breakdown, 'יום בחודש' if is_hebrew else 'Day of Month', '#f093fb', is_hebrew
+                ))
+                st.plotly_chart(fig_monthly, use_container_width=True)
+        
             with col2:
-                # Removed emoji metric due to display issues
-                pass
-            
-            # Top 5 words
-            st.markdown("#### " + ("חמש המילים הנפוצות ביותר" if is_hebrew else "Top 5 Words"))
-            all_words = []
-            for msg in user_data['message']:
-                # Remove emojis and special characters, split into words
-                clean_msg = re.sub(r'[^\w\s]', '', str(msg))
-                words = clean_msg.split()
-                # Filter out "media", "omitted" and short words
-                filtered_words = [word.lower() for word in words if len(word) > 2 and word.lower() not in ['media', 'omitted']]
-                all_words.extend(filtered_words)
+                # Hourly breakdown
+                fig_hourly = run_stage('chart: hourly', figure_key, lambda: breakdown_figure(
+                    breakdowns['hourly'], hourly_breakdown, 'שעה' if is_hebrew else 'Hour', '#f5576c', is_hebrew
+                ))
+                st.plotly_chart(fig_hourly, use_container_width=True)
             
-            if all_words:
-                word_counts = Counter(all_words)
-                top_words = word_counts.most_common(5)
-                
-                # Display as a small horizontal bar chart
-                fig_top_words = px.bar(
-                    x=[count for word, count in top_words],
-                    y=[word for word, count in top_words],
-                    orientation='h',
-                    labels={'x': 'כמות' if is_hebrew else 'Count', 'y': 'מילה' if is_hebrew else 'Word'},
-                    color_discrete_sequence=['#667eea']
-                )
-                fig_top_words.update_layout(height=250, showlegend=False)
-                fig_top_words.update_traces(
-                    texttemplate='%{x}',
-                    textposition='outside'
-                )
-                st.plotly_chart(fig_top_words, use_container_width=True)
-            else:
-                st.info("אין מספיק מילים לניתוח" if is_hebrew else "Not enough words for analysis")
-        
-        # Fun Facts
-        st.markdown(f'<div class="section-header">🎭 {fun_facts}</div>', unsafe_allow_html=True)
-        fun_facts_list = create_fun_facts(df_filtered, leaderboards)
-        
-        for fact in fun_facts_list:
-            st.markdown(f'<div class="metric-card">{fact}</div>', unsafe_allow_html=True)
-        
-        # Leaderboards
-        st.markdown(f'<div class="section-header">{leaderboard_title}</div>', unsafe_allow_html=True)
-        
-        tab1, tab2, tab3, tab4, tab5 = st.tabs([
-            "📱 " + messages_leaderboard,
-            "😄 " + most_emojis,
-            "📝 " + longest_messages,
-            "🖼️ " + most_media,
-            "😆 " + most_haha
-        ])
-        
-        with tab1:
-            most_messages_df = leaderboards['most_messages'].reset_index()
-            most_messages_df.columns = ['משתמש' if is_hebrew else 'User', 'הודעות' if is_hebrew else 'Messages']
-            most_messages_df['אחוז' if is_hebrew else 'Percentage'] = (most_messages_df['הודעות' if is_hebrew else 'Messages'] / most_messages_df['הודעות' if is_hebrew else 'Messages'].sum() * 100).round(1)
-            st.dataframe(most_messages_df, use_container_width=True)
-        
-        with tab2:
-            emoji_df = pd.DataFrame(leaderboards['most_emojis'], columns=['אימוגי' if is_hebrew else 'Emoji', 'כמות' if is_hebrew else 'Count'])
-            st.dataframe(emoji_df, use_container_width=True)
-        
-        with tab3:
-            longest_df = leaderboards['longest_messages'][['sender', 'message', 'message_length']].copy()
-            longest_df.columns = ['משתמש' if is_hebrew else 'User', 'הודעה' if is_hebrew else 'Message', 'אורך' if is_hebrew else 'Length']
-            st.dataframe(longest_df, use_container_width=True)
-        
-        with tab4:
-            media_df = leaderboards['most_media'].reset_index()
-            media_df.columns = ['משתמש' if is_hebrew else 'User', 'כמות' if is_hebrew else 'Count']
-            st.dataframe(media_df, use_container_width=True)
-        
-        with tab5:
-            haha_df = leaderboards['most_haha'].reset_index()
-            haha_df.columns = ['משתמש' if is_hebrew else 'User', 'כמות' if is_hebrew else 'Count']
-            st.dataframe(haha_df, use_container_width=True)
-        
-        # Time breakdowns
-        st.markdown(f'<div class="section-header">📊 פילוח לפי זמן</div>', unsafe_allow_html=True)
+                # Activity over time
+                fig_daily = run_stage('chart: daily', figure_key, lambda: activity_figure(cube_filtered, is_hebrew))
+                st.plotly_chart(fig_daily, use_container_width=True)
         
-        col1, col2 = st.columns(2)
+            # Weekly change percentage chart (last N days)
+            st.markdown(f'<div class="section-header">📈 אחוז שינוי שבועי</div>', unsafe_allow_html=True)
+            weekly_change_section(cube_filtered, filter_key)
         
-        with col1:
-            # Weekly breakdown
-            weekly_data = breakdowns['weekly']
-            fig_weekly = px.bar(
-                x=weekly_data.index,
-                y=weekly_data.values,
-                title=weekly_breakdown,
-                labels={'x': 'יום' if is_hebrew else 'Day', 'y': 'הודעות' if is_hebrew else 'Messages'},
-                color_discrete_sequence=['#667eea']
-            )
-            # Add value labels on bars
-            fig_weekly.update_traces(
-                texttemplate='%{y}',
-                textposition='outside'
-            )
-            fig_weekly.update_layout(height=300, showlegend=False)
-            st.plotly_chart(fig_weekly, use_container_width=True)
-            
-            # Monthly breakdown
-            monthly_data = breakdowns['monthly']
-            fig_monthly = px.bar(
-                x=monthly_data.index,
-                y=monthly_data.values,
-                title=monthly_breakdown,
-                labels={'x': 'יום בחודש' if is_hebrew else 'Day of Month', 'y': 'הודעות' if is_hebrew else 'Messages'},
-                color_discrete_sequence=['#f093fb']
-            )
-            # Add value labels on bars
-            fig_monthly.update_traces(
-                texttemplate='%{y}',
-                textposition='outside'
-            )
-            fig_monthly.update_layout(height=300, showlegend=False)
-            st.plotly_chart(fig_monthly, use_container_width=True)
-        
-        with col2:
-            # Hourly breakdown
-            hourly_data = breakdowns['hourly']
-            fig_hourly = px.bar(
-                x=hourly_data.index,
-                y=hourly_data.values,
-                title=hourly_breakdown,
-                labels={'x': 'שעה' if is_hebrew else 'Hour', 'y': 'הודעות' if is_hebrew else 'Messages'},
-                color_discrete_sequence=['#f5576c']
-            )
-            # Add value labels on bars
-            fig_hourly.update_traces(
-                texttemplate='%{y}',
-                textposition='outside'
-            )
-            fig_hourly.update_layout(height=300, showlegend=False)
-            st.plotly_chart(fig_hourly, use_container_width=True)
-            
-            # Daily activity over time
-            daily_data = df_filtered.groupby(df_filtered['datetime'].dt.date).size()
-            fig_daily = px.line(
-                x=daily_data.index,
-                y=daily_data.values,
-                title="פעילות יומית" if is_hebrew else "Daily Activity",
-                labels={'x': 'תאריך' if is_hebrew else 'Date', 'y': 'הודעות' if is_hebrew else 'Messages'}
-            )
-            fig_daily.update_layout(height=300, showlegend=False)
-            st.plotly_chart(fig_daily, use_container_width=True)
 
-        # Weekly change percentage chart (last 60 days)
-        st.markdown(f'<div class="section-header">📈 אחוז שינוי שבועי (60 ימים אחרונים)</div>', unsafe_allow_html=True)
-        
-        # Get last 60 days data
-        latest_date = df_filtered['datetime'].max()
-        sixty_days_ago = latest_date - timedelta(days=60)
-        last_sixty_days_data = df_filtered[df_filtered['datetime'] >= sixty_days_ago]
-        
-        if not last_sixty_days_data.empty:
-            # Group by week and calculate percentage change
-            weekly_counts = last_sixty_days_data.groupby(last_sixty_days_data['datetime'].dt.isocalendar().week).size()
-            
-            if len(weekly_counts) > 1:
-                # Calculate percentage change
-                weekly_changes = []
-                week_labels = []
-                
-                for i in range(1, len(weekly_counts)):
-                    current_week = weekly_counts.index[i]
-                    prev_week = weekly_counts.index[i-1]
-                    
-                    current_count = weekly_counts.iloc[i]
-                    prev_count = weekly_counts.iloc[i-1]
-                    
-                    if prev_count > 0:
-                        change_percent = ((current_count - prev_count) / prev_count) * 100
-                    else:
-                        change_percent = 0
-                    
-                    # Limit extreme values to prevent chart cutoff
-                    if change_percent > 500:
-                        change_percent = 500
-                    elif change_percent < -500:
-                        change_percent = -500
-                    
-                    weekly_changes.append(change_percent)
-                    
-                    # Create date range label for the week
-                    week_start = last_sixty_days_data[last_sixty_days_data['datetime'].dt.isocalendar().week == current_week]['datetime'].min()
-                    week_end = last_sixty_days_data[last_sixty_days_data['datetime'].dt.isocalendar().week == current_week]['datetime'].max()
-                    
-                    if week_start and week_end:
-                        start_str = week_start.strftime('%d/%m')
-                        end_str = week_end.strftime('%d/%m')
-                        week_labels.append(f"{start_str}-{end_str}")
-                    else:
-                        week_labels.append(f"שבוע {current_week}" if is_hebrew else f"Week {current_week}")
-                
-                if weekly_changes:
-                    # Get the actual message counts for each week
-                    week_counts = []
-                    for i in range(1, len(weekly_counts)):
-                        current_week = weekly_counts.index[i]
-                        current_count = weekly_counts.iloc[i]
-                        week_counts.append(current_count)
-                    
-                    # Create single chart with bars and line overlay
-                    import plotly.graph_objects as go
-                    
-                    fig_combined = go.Figure()
-                    
-                    # Add bars for message counts
-                    fig_combined.add_trace(
-                        go.Bar(
-                            x=week_labels,
-                            y=week_counts,
-                            name="הודעות" if is_hebrew else "Messages",
-                            marker_color='#667eea',
-                            text=week_counts,
-                            textposition='outside',
-                            yaxis='y'
-                        )
-                    )
-                    
-                    # Add line for percentage changes on secondary y-axis
-                    fig_combined.add_trace(
-                        go.Scatter(
-                            x=week_labels,
-                            y=weekly_changes,
-                            name="אחוז שינוי" if is_hebrew else "Change %",
-                            mode='lines+markers',
-                            line=dict(color='#f093fb', width=3),
-                            marker=dict(size=8),
-                            text=[f"{p:.1f}%" for p in weekly_changes],
-                            textposition='top center',
-                            yaxis='y2'
-                        )
-                    )
-                    
-                    fig_combined.update_layout(
-                        height=400,
-                        title="הודעות ואחוז שינוי שבועי" if is_hebrew else "Weekly Messages and Change Percentage",
-                        xaxis_title="תאריכים" if is_hebrew else "Dates",
-                        yaxis=dict(
-                            title="הודעות" if is_hebrew else "Messages",
-                            side='left',
-                            showgrid=True
-                        ),
-                        yaxis2=dict(
-                            title="אחוז שינוי" if is_hebrew else "Change %",
-                            side='right',
-                            overlaying='y',
-                            showgrid=False
-                        ),
-                        legend=dict(
-                            orientation="h",
-                            yanchor="bottom",
-                            y=1.02,
-                            xanchor="right",
-                            x=1
-                        )
-                    )
-                    
-                    st.plotly_chart(fig_combined, use_container_width=True)
-                else:
-                    st.info("אין מספיק נתונים לחישוב שינויים שבועיים" if is_hebrew else "Not enough data for weekly changes")
-            else:
-                st.info("אין מספיק שבועות לניתוח" if is_hebrew else "Not enough weeks for analysis")
-        else:
-            st.info("אין נתונים ב-60 הימים האחרונים" if is_hebrew else "No data in last 60 days")
-        
 
+    else:
+        st.info(no_file_label) 
+except StopPage:
+    pass
+finally:
+    # Always reached, so a stopped or failed rerun can't leave the profiler running for the next profiled one
+    if profiler is not None:
+        profiler.disable()
 
-else:
-    st.info(no_file_label) 
\ No newline at end of file
+    # Diagnostics panel: filled last, so it covers every stage of this rerun
+    if show_diagnostics:
+        rerun_seconds = time.perf_counter() - rerun_started
+        with st.sidebar.expander(stage_times, expanded=True):
+            if stage_timings:
+                timings_df = pd.DataFrame(stage_timings).reindex(columns=['stage', 'seconds', 'rows', 'cache'])
+                timings_df['share'] = (timings_df['seconds'] / rerun_seconds * 100).round(1)
+                st.dataframe(
+                    timings_df, hide_index=True, use_container_width=True,
+                    column_config={'seconds': st.column_config.NumberColumn(format="%.4f"), 'rows': st.column_config.NumberColumn(format="%d")}
+                )
+            st.caption(
+                f"⏱️ זמן ריצה כולל: {rerun_seconds:.3f} שניות" if is_hebrew
+                else f"⏱️ Whole rerun: {rerun_seconds:.3f}s"
+            )
+            if profiler is not None:
+                profiler.create_stats()
+                summary = io.StringIO()
+                pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(25)
+                st.download_button(
+                    "⬇️ cProfile (.prof)",
+                    data=marshal.dumps(profiler.stats),
+                    file_name="whatsapp_analyzer_rerun.prof",
+                    mime="application/octet-stream",
+                    help="pstats / snakeviz"
+                )
+                st.code(summary.getvalue(), language=None)
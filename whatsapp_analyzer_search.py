@@ -0,0 +1,152 @@
+"""Full-text message search on SQLite FTS5.
+
+Messages live in a plain table (id, ts, sender, message) with an
+external-content FTS5 index over the text, so the text is stored once. Ids
+follow ingestion order, which is chronological, so results come back newest
+first straight from the index and a date range narrows to an id range before
+any row is read. New messages are appended as they are ingested; nothing is
+rebuilt.
+"""
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+
+SEARCH_SCHEMA_VERSION = 1
+# unicode61 treats Hebrew letters as token characters; remove_diacritics also folds niqqud
+SEARCH_TOKENIZER = 'unicode61 remove_diacritics 2'
+# Rows inserted per executemany batch while indexing
+INDEX_BATCH_ROWS = 50_000
+DEFAULT_PAGE_SIZE = 20
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_ts ON messages (ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    message, content='messages', content_rowid='id', tokenize='{SEARCH_TOKENIZER}', prefix='2 3'
+);
+PRAGMA user_version = {SEARCH_SCHEMA_VERSION};
+"""
+
+# A quoted phrase, or a bare term with an optional trailing * for prefix search
+_QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+
+
+class _SearchConnection(sqlite3.Connection):
+    """Connection shared between threads; writers hold its lock"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+
+
+def open_search_index(path=':memory:'):
+    """Open (creating if needed) a search index in a file or in memory"""
+    conn = sqlite3.connect(path, check_same_thread=False, factory=_SearchConnection)
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def indexed_count(conn):
+    """Number of messages in the index"""
+    return conn.execute('SELECT count(*) FROM messages').fetchone()[0]
+
+
+def index_messages(conn, df, batch_size=INDEX_BATCH_ROWS):
+    """Append the messages of df to the index in batches; returns the number added"""
+    if df.empty:
+        return 0
+    timestamps = (df['datetime'].astype('datetime64[s]').astype('int64')).tolist()
+    senders = df['sender'].astype(str).tolist()
+    messages = df['message'].astype(str).tolist()
+    with conn.lock:
+        with conn:
+            start = conn.execute('SELECT coalesce(max(id), 0) + 1 FROM messages').fetchone()[0]
+            for offset in range(0, len(df), batch_size):
+                ids = range(start + offset, start + min(offset + batch_size, len(df)))
+                rows = list(zip(ids, timestamps[offset:offset + batch_size], senders[offset:offset + batch_size],
+                                messages[offset:offset + batch_size]))
+                conn.executemany('INSERT INTO messages (id, ts, sender, message) VALUES (?, ?, ?, ?)', rows)
+                conn.executemany('INSERT INTO messages_fts (rowid, message) VALUES (?, ?)',
+                                 [(row[0], row[3]) for row in rows])
+    return len(df)
+
+
+def build_fts_query(text):
+    """Turn search box text into a safe FTS5 query, or None if there is nothing to search.
+
+    "quoted words" match as a phrase, a trailing * makes a prefix search, and
+    all parts must match. Everything else FTS5 would treat as syntax is quoted.
+    """
+    parts = []
+    for phrase, term in _QUERY_PART.findall(text):
+        if phrase.strip():
+            parts.append('"' + phrase.strip().replace('"', '') + '"')
+        elif term:
+            prefix = term.endswith('*')
+            term = term.rstrip('*').replace('"', '')
+            if term:
+                parts.append('"' + term + '"' + ('*' if prefix else ''))
+    return ' '.join(parts) or None
+
+
+def _id_range(conn, start, end):
+    """Smallest and largest message id inside [start, end], from the ts index"""
+    low = high = None
+    if start is not None:
+        low = conn.execute('SELECT min(id) FROM messages WHERE ts >= ?', (int(pd.Timestamp(start).timestamp()),)).fetchone()[0]
+    if end is not None:
+        high = conn.execute('SELECT max(id) FROM messages WHERE ts <= ?', (int(pd.Timestamp(end).timestamp()),)).fetchone()[0]
+    return low, high
+
+
+def search_messages(conn, text, senders=None, start=None, end=None, page=0, page_size=DEFAULT_PAGE_SIZE):
+    """Messages matching the search box text, newest first, one page at a time.
+
+    senders, start and end narrow the results like the rest of the page.
+    Returns (DataFrame of datetime/sender/message, total number of matches).
+    """
+    columns = ['datetime', 'sender', 'message']
+    query = build_fts_query(text)
+    if query is None:
+        return pd.DataFrame(columns=columns), 0
+
+    conditions = ['messages_fts MATCH ?']
+    params = [query]
+    low, high = _id_range(conn, start, end)
+    if (start is not None and low is None) or (end is not None and high is None):
+        return pd.DataFrame(columns=columns), 0
+    # Ids are close to chronological: the id range narrows the scan, the ts bounds keep it exact
+    if low is not None:
+        conditions += ['messages_fts.rowid >= ?', 'm.ts >= ?']
+        params += [low, int(pd.Timestamp(start).timestamp())]
+    if high is not None:
+        conditions += ['messages_fts.rowid <= ?', 'm.ts <= ?']
+        params += [high, int(pd.Timestamp(end).timestamp())]
+    if senders is not None:
+        senders = [str(sender) for sender in senders]
+        conditions.append(f"m.sender IN ({', '.join('?' * len(senders))})")
+        params += senders
+
+    where = ' AND '.join(conditions)
+    source = 'messages_fts JOIN messages m ON m.id = messages_fts.rowid'
+    try:
+        total = conn.execute(f'SELECT count(*) FROM {source} WHERE {where}', params).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT m.ts, m.sender, m.message FROM {source} WHERE {where} '
+            f'ORDER BY messages_fts.rowid DESC LIMIT ? OFFSET ?',
+            params + [page_size, page * page_size]
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # Queries FTS5 still can't parse (e.g. only punctuation) match nothing
+        return pd.DataFrame(columns=columns), 0
+
+    results = pd.DataFrame(rows, columns=['ts', 'sender', 'message'])
+    results.insert(0, 'datetime', pd.to_datetime(results.pop('ts'), unit='s'))
+    return results[columns], total
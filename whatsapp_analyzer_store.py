@@ -0,0 +1,376 @@
+"""Local on-disk store of parsed chats.
+
+Each chat lives in <root>/<chat_id>/ as a Parquet dataset partitioned by month
+(month=YYYYMM directories) plus a meta.json describing it, so a chat can be
+reloaded without re-parsing and date ranges only read the months they cover.
+counts.parquet keeps per (day, hour, sender) message counts, tokens.parquet
+per (day, sender, word) counts and search.sqlite a full-text index next to it,
+and a newer export of a stored chat only appends its new tail to all four.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from whatsapp_analyzer_core import (
+    ENCODING_SAMPLE_BYTES,
+    FEATURE_COLUMNS,
+    MESSAGE_DTYPE,
+    WEEKDAY_DTYPE,
+    build_token_index,
+    count_messages,
+    decode_export,
+    find_tail_offset,
+    merge_counts,
+    merge_token_counts,
+    message_features,
+    open_txt_from_zip,
+    parse_whatsapp_bytes,
+    parse_whatsapp_stream,
+    sniff_encoding,
+    token_counts,
+)
+from whatsapp_analyzer_search import index_messages, indexed_count, open_search_index
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_store')
+# 2: message feature columns are stored with the messages
+# 3: tokens.parquet keeps the word counts (built on first load for older chats)
+STORE_SCHEMA_VERSION = 3
+# Messages hashed from the start of a chat to identify it across uploads
+IDENTITY_MESSAGES = 50
+# Bytes from the start of an upload parsed to recognise a stored chat
+IDENTITY_SAMPLE_BYTES = 256 * 1024
+# How far before the last stored message a newer export is re-read and deduplicated
+DEFAULT_OVERLAP = pd.Timedelta(hours=1)
+
+
+def chat_identity(df):
+    """Stable id for a chat, derived from its first messages"""
+    head = df.head(IDENTITY_MESSAGES)
+    digest = hashlib.blake2b(digest_size=12)
+    for timestamp, sender, message in zip(head['datetime'], head['sender'], head['message']):
+        digest.update(f"{timestamp.isoformat()}\x1f{sender}\x1f{message}\x1e".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _month_key(timestamp):
+    return timestamp.year * 100 + timestamp.month
+
+
+def _meta_path(chat_id, root):
+    return os.path.join(root, chat_id, 'meta.json')
+
+
+def _search_path(chat_dir):
+    return os.path.join(chat_dir, 'search.sqlite')
+
+
+def _tokens_path(chat_dir):
+    return os.path.join(chat_dir, 'tokens.parquet')
+
+
+def _write_meta(meta, chat_dir):
+    path = os.path.join(chat_dir, 'meta.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _write_partitions(df, data_dir, sequence):
+    """Append df to the month-partitioned dataset; returns the months written.
+
+    File names carry the write sequence so partitions list in chronological order.
+    """
+    timestamps = df['datetime']
+    month = (timestamps.dt.year * 100 + timestamps.dt.month).astype('int32')
+    table = pa.Table.from_pandas(df, preserve_index=False).append_column('month', pa.array(month.to_numpy()))
+    pq.write_to_dataset(table, data_dir, partition_cols=['month'], basename_template=f'part-{sequence:05d}-{{i}}.parquet')
+    return sorted(int(m) for m in month.unique())
+
+
+def read_chat_meta(chat_id, root=DEFAULT_STORE_DIR):
+    """meta.json of a stored chat, or None if it isn't stored"""
+    try:
+        with open(_meta_path(chat_id, root), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_stored_chats(root=DEFAULT_STORE_DIR):
+    """Metadata of every stored chat, most recently saved first"""
+    if not os.path.isdir(root):
+        return []
+    # Dot-prefixed entries are staging directories of saves in progress
+    chats = [read_chat_meta(chat_id, root) for chat_id in os.listdir(root) if not chat_id.startswith('.')]
+    return sorted((meta for meta in chats if meta), key=lambda meta: meta['saved_at'], reverse=True)
+
+
+def save_stored_chat(df, name, root=DEFAULT_STORE_DIR, chat_id=None):
+    """Write a parsed chat as a month-partitioned Parquet dataset, replacing any previous copy.
+
+    Returns the chat's metadata.
+    """
+    chat_id = chat_id or chat_identity(df)
+    chat_dir = os.path.join(root, chat_id)
+    os.makedirs(root, exist_ok=True)
+
+    timestamps = df['datetime']
+    # Write next to the final location and swap in, so readers never see a half-written chat
+    staging = tempfile.mkdtemp(prefix=f'.{chat_id}-', dir=root)
+    months = _write_partitions(df, os.path.join(staging, 'data'), 0)
+    count_messages(df).to_parquet(os.path.join(staging, 'counts.parquet'), index=False)
+    token_counts(build_token_index(df)).to_parquet(_tokens_path(staging), index=False)
+    search = open_search_index(_search_path(staging))
+    index_messages(search, df)
+    search.close()
+    meta = {
+        'chat_id': chat_id,
+        'name': name,
+        'rows': len(df),
+        'first_timestamp': timestamps.min().isoformat() if len(df) else None,
+        'last_timestamp': timestamps.max().isoformat() if len(df) else None,
+        'months': months,
+        'timestamp_format': df.attrs.get('timestamp_format'),
+        'schema_version': STORE_SCHEMA_VERSION,
+        'appends': 0,
+        'saved_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    _write_meta(meta, staging)
+
+    if os.path.exists(chat_dir):
+        shutil.rmtree(chat_dir)
+    os.replace(staging, chat_dir)
+    return meta
+
+
+def load_stored_chat(chat_id, root=DEFAULT_STORE_DIR, start=None, end=None):
+    """Load a stored chat, optionally limited to start <= datetime <= end.
+
+    Only the month partitions overlapping the range are opened. The frame comes
+    back sorted, in the compact message schema, with the stored metadata in
+    df.attrs.
+    """
+    meta = read_chat_meta(chat_id, root)
+    if meta is None:
+        raise FileNotFoundError(f"No stored chat {chat_id} in {root}")
+
+    dataset = ds.dataset(os.path.join(root, chat_id, 'data'), format='parquet', partitioning='hive')
+    row_filter = None
+    if start is not None:
+        start = pd.Timestamp(start)
+        row_filter = (ds.field('month') >= _month_key(start)) & (ds.field('datetime') >= start)
+    if end is not None:
+        end = pd.Timestamp(end)
+        end_filter = (ds.field('month') <= _month_key(end)) & (ds.field('datetime') <= end)
+        row_filter = end_filter if row_filter is None else row_filter & end_filter
+
+    table = dataset.to_table(filter=row_filter).drop_columns(['month'])
+    df = table.to_pandas(types_mapper={pa.string(): MESSAGE_DTYPE, pa.large_string(): MESSAGE_DTYPE}.get)
+    df = df.astype({'sender': 'category', 'weekday': WEEKDAY_DTYPE})
+    if not set(FEATURE_COLUMNS) <= set(df.columns):
+        # Chats saved before the feature columns existed
+        df = df.assign(**message_features(df['message']))
+    if 'day' not in df.columns:
+        # Chats saved before the day column existed
+        df.insert(df.columns.get_loc('datetime') + 1, 'day', df['datetime'].dt.normalize())
+    if not df['datetime'].is_monotonic_increasing:
+        df = df.sort_values('datetime', kind='stable', ignore_index=True)
+
+    if meta.get('timestamp_format'):
+        df.attrs['timestamp_format'] = meta['timestamp_format']
+    df.attrs['stored_chat'] = meta
+    return df
+
+
+def load_stored_counts(chat_id, root=DEFAULT_STORE_DIR):
+    """Per (day, hour, sender) message counts of a stored chat"""
+    counts = pd.read_parquet(os.path.join(root, chat_id, 'counts.parquet'))
+    return counts.astype({'sender': 'category'})
+
+
+def load_stored_token_counts(chat_id, root=DEFAULT_STORE_DIR):
+    """Per (day, sender, word) counts of a stored chat's words (see token_counts).
+
+    Chats saved before the counts were kept have them built here once.
+    """
+    path = _tokens_path(os.path.join(root, chat_id))
+    if not os.path.exists(path):
+        token_counts(build_token_index(load_stored_chat(chat_id, root))).to_parquet(path, index=False)
+    return pd.read_parquet(path)
+
+
+def open_stored_search(chat_id, root=DEFAULT_STORE_DIR):
+    """Full-text search index of a stored chat.
+
+    Chats saved before the index existed, or whose index fell out of step with
+    the stored messages, are (re)indexed here once.
+    """
+    meta = read_chat_meta(chat_id, root)
+    if meta is None:
+        raise FileNotFoundError(f"No stored chat {chat_id} in {root}")
+    path = _search_path(os.path.join(root, chat_id))
+    search = open_search_index(path)
+    if indexed_count(search) != meta['rows']:
+        search.close()
+        os.remove(path)
+        search = open_search_index(path)
+        index_messages(search, load_stored_chat(chat_id, root))
+    return search
+
+
+def match_stored_chat(data, root=DEFAULT_STORE_DIR):
+    """Metadata of the stored chat that UTF-8 export bytes belong to, or None.
+
+    The head of the upload is parsed with each stored chat's own timestamp
+    format and compared against its identity.
+    """
+    head = data[:IDENTITY_SAMPLE_BYTES]
+    if len(head) < len(data):
+        # Drop the partial last line
+        head = head[:head.rfind(b'\n') + 1]
+    for meta in list_stored_chats(root):
+        timestamp_format = meta.get('timestamp_format')
+        if not timestamp_format:
+            continue
+        head_df = parse_whatsapp_stream(io.BytesIO(head), timestamp_format=timestamp_format)
+        if len(head_df) and chat_identity(head_df) == meta['chat_id']:
+            return meta
+    return None
+
+
+def _dedup_keys(df):
+    """(timestamp, sender, text hash, occurrence) per message; occurrence keeps repeated identical messages apart"""
+    keys = pd.DataFrame({
+        'datetime': df['datetime'].astype('datetime64[ns]').to_numpy(),
+        'sender': df['sender'].astype(str).to_numpy(),
+        'text_hash': pd.util.hash_pandas_object(df['message'], index=False).to_numpy(),
+    })
+    keys['occurrence'] = keys.groupby(['datetime', 'sender', 'text_hash']).cumcount()
+    return keys
+
+
+def update_stored_chat(data, meta, root=DEFAULT_STORE_DIR, overlap=DEFAULT_OVERLAP):
+    """Append the messages of a newer export that the stored chat doesn't have yet.
+
+    Only the tail from (last stored timestamp - overlap) is parsed; messages in
+    the overlap are dropped if already stored. New rows are written as extra
+    partition files, folded into counts.parquet and tokens.parquet and appended
+    to the search index, so nothing is rebuilt.
+    Returns (updated meta, number of rows added).
+    """
+    chat_id = meta['chat_id']
+    chat_dir = os.path.join(root, chat_id)
+    timestamp_format = meta['timestamp_format']
+    cutoff = pd.Timestamp(meta['last_timestamp']) - overlap
+
+    offset = find_tail_offset(data, timestamp_format, cutoff)
+    tail = parse_whatsapp_stream(
+        io.BytesIO(data[offset:]), encoding='utf-8-sig' if offset == 0 else 'utf-8', timestamp_format=timestamp_format
+    )
+    if tail.empty:
+        return meta, 0
+
+    stored = load_stored_chat(chat_id, root, start=cutoff)
+    merged = _dedup_keys(tail).merge(_dedup_keys(stored), how='left', indicator=True)
+    new_rows = tail[(merged['_merge'] == 'left_only').to_numpy()]
+    if new_rows.empty:
+        return meta, 0
+
+    # Bring the search index and word counts up to the stored rows before adding the new ones
+    search = open_stored_search(chat_id, root)
+    stored_tokens = load_stored_token_counts(chat_id, root)
+    sequence = meta.get('appends', 0) + 1
+    months = _write_partitions(new_rows, os.path.join(chat_dir, 'data'), sequence)
+    counts = merge_counts(load_stored_counts(chat_id, root), count_messages(new_rows))
+    counts.to_parquet(os.path.join(chat_dir, 'counts.parquet'), index=False)
+    new_tokens = token_counts(build_token_index(new_rows))
+    # Only the days the new rows fall on need adding up; earlier days are kept as they are
+    recent = (stored_tokens['day'] >= new_tokens['day'].min()).to_numpy()
+    tokens = pd.concat([stored_tokens[~recent], merge_token_counts(stored_tokens[recent], new_tokens)], ignore_index=True)
+    tokens.astype({'sender': 'category', 'word': 'category'}).to_parquet(_tokens_path(chat_dir), index=False)
+    index_messages(search, new_rows)
+    search.close()
+
+    meta = dict(
+        meta,
+        rows=meta['rows'] + len(new_rows),
+        last_timestamp=max(pd.Timestamp(meta['last_timestamp']), new_rows['datetime'].max()).isoformat(),
+        months=sorted(set(meta['months']) | set(months)),
+        appends=sequence,
+        saved_at=datetime.now().isoformat(timespec='seconds'),
+    )
+    _write_meta(meta, chat_dir)
+    return meta, len(new_rows)
+
+
+def _export_chat_bytes(data, name):
+    """UTF-8 chat text of the bytes of an export (.txt, or .zip by name)"""
+    if name.lower().endswith('.zip'):
+        stream, _ = open_txt_from_zip(io.BytesIO(data))
+        if stream is None:
+            raise ValueError('no .txt chat file in the archive')
+        with stream:
+            data = stream.read()
+    if sniff_encoding(data[:ENCODING_SAMPLE_BYTES]) != 'utf-8-sig':
+        # Matching and tail appends scan UTF-8 bytes
+        data = decode_export(data).encode('utf-8')
+    return data
+
+
+def export_identity(data, name):
+    """(chat id, chat text size) of the bytes of an export, from the head of its chat text.
+
+    Exports of one chat share their first messages, so they get the same id;
+    a later export holds more text. The id is None when the head has no messages.
+    """
+    data = _export_chat_bytes(data, name)
+    head = data[:IDENTITY_SAMPLE_BYTES]
+    if len(head) < len(data):
+        # Drop the partial last line
+        head = head[:head.rfind(b'\n') + 1]
+    head_df = parse_whatsapp_bytes(head, workers=1)
+    return (chat_identity(head_df) if len(head_df) else None), len(data)
+
+
+def import_export(data, name, root=DEFAULT_STORE_DIR):
+    """Store the bytes of an export (.txt, or .zip by name), appending to the stored chat it continues if any.
+
+    Made to run in a worker process: it takes and returns plain data and
+    parses serially. Returns (meta, rows added); raises ValueError when there
+    is no chat to store.
+    """
+    data = _export_chat_bytes(data, name)
+    meta = match_stored_chat(data, root)
+    if meta is not None:
+        return update_stored_chat(data, meta, root)
+    df = parse_whatsapp_bytes(data, workers=1)
+    if df.empty:
+        raise ValueError('no messages found')
+    return save_stored_chat(df, name, root), len(df)
+
+
+def import_exports(exports, root=DEFAULT_STORE_DIR):
+    """Store several exports of one chat one after another, in the order given.
+
+    Exports of the same chat must not be imported concurrently: each would
+    save its own copy and the last to finish would win. Pass them oldest
+    first, so the first is saved and later ones append their new messages.
+    Made to run in a worker process. Returns ((meta, rows added), error) per
+    export, with error a message and the result None when it couldn't be stored.
+    """
+    results = []
+    for data, name in exports:
+        try:
+            results.append((import_export(data, name, root), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results